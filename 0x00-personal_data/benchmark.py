@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+""" Benchmarks for the personal data helpers
+
+./benchmark.py [name ...] runs the named benchmarks (default: all).
+The suite benchmark writes machine-readable results with --output and
+compares them to an earlier run with --compare.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import time
+import timeit
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, List
+
+from bulk_redact import redact_files
+from encrypt_password import (hash_password, hash_passwords, is_valid,
+                              verify_many)
+from field_automaton import field_automaton
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+
+def per_field_filter_datum(fields: List[str], redaction: str, message: str,
+                           separator: str) -> str:
+    """ Reference implementation: one re.sub per field """
+    for field in fields:
+        message = re.sub(f'{field}=(.*?){separator}',
+                         f'{field}={redaction}{separator}', message)
+    return message
+
+
+def synthetic_fields(count: int) -> List[str]:
+    """ Build a list of count field names """
+    return ["field{}".format(i) for i in range(count)]
+
+
+def synthetic_message(fields: List[str], separator: str = ';') -> str:
+    """ Build a log line holding a value for every field """
+    return ''.join('{}=value{}{}'.format(field, i, separator)
+                   for i, field in enumerate(fields))
+
+
+def bench_redaction(counts=(5, 50, 500), number: int = 200) -> None:
+    """ Compare filter_datum and the automaton with the per-field loop """
+    print("{:>7} {:>14} {:>14} {:>15}".format(
+        "fields", "per-field (us)", "compiled (us)", "automaton (us)"))
+    for count in counts:
+        fields = synthetic_fields(count)
+        message = synthetic_message(fields)
+        automaton = field_automaton(tuple(fields))
+        expected = per_field_filter_datum(fields, 'xxx', message, ';')
+        assert filter_datum(fields, 'xxx', message, ';') == expected
+        assert automaton.redact(message, 'xxx', ';') == expected
+
+        timings = [min(timeit.repeat(run, number=number, repeat=3)) / number
+                   for run in (
+            lambda: per_field_filter_datum(fields, 'xxx', message, ';'),
+            lambda: filter_datum(fields, 'xxx', message, ';'),
+            lambda: automaton.redact(message, 'xxx', ';'))]
+        print("{:>7} {:>14.2f} {:>14.2f} {:>15.2f}".format(
+            count, *(t * 1e6 for t in timings)))
+
+    # Fixed message, growing dictionary: only the automaton stays flat
+    message = synthetic_message(list(PII_FIELDS)) + 'ip=10.0.0.1;'
+    print("\n{:>7} {:>14} {:>15}  (5-field message)".format(
+        "fields", "compiled (us)", "automaton (us)"))
+    for count in counts:
+        fields = list(PII_FIELDS) + synthetic_fields(count)
+        automaton = field_automaton(tuple(fields))
+        timings = [min(timeit.repeat(run, number=number, repeat=3)) / number
+                   for run in (
+            lambda: filter_datum(fields, 'xxx', message, ';'),
+            lambda: automaton.redact(message, 'xxx', ';'))]
+        print("{:>7} {:>14.2f} {:>15.2f}".format(
+            len(fields), *(t * 1e6 for t in timings)))
+
+
+def bench_bulk(size_mb: int = 64) -> None:
+    """ Throughput of bulk_redact for each worker count """
+    line = (synthetic_message(list(PII_FIELDS)) +
+            'ip=10.0.0.1;user_agent=Mozilla/5.0;\n').encode()
+    with tempfile.NamedTemporaryFile(suffix='.log', delete=False) as f:
+        f.write(line * (size_mb * 1024 * 1024 // len(line)))
+        path = f.name
+    try:
+        size = os.path.getsize(path) / (1024 * 1024)
+        print("{:>7} {:>10} {:>8}".format("workers", "MB/s", "scaling"))
+        base = None
+        for workers in range(1, (os.cpu_count() or 1) + 1):
+            with open(os.devnull, 'wb') as out:
+                start = time.perf_counter()
+                redact_files([path], out, workers, 1024 * 1024)
+                rate = size / (time.perf_counter() - start)
+            base = base or rate
+            print("{:>7} {:>10.1f} {:>7.2f}x".format(
+                workers, rate, rate / base))
+    finally:
+        os.remove(path)
+
+
+def bench_hashing(count: int = 64) -> None:
+    """ Speed-up of the batch bcrypt APIs by thread count """
+    passwords = ["password{}".format(i) for i in range(count)]
+    print("{:>7} {:>12} {:>12} {:>8}".format(
+        "workers", "hash/s", "verify/s", "speedup"))
+    base = None
+    for workers in range(1, (os.cpu_count() or 1) + 1):
+        start = time.perf_counter()
+        hashed = list(hash_passwords(passwords, workers))
+        hash_rate = count / (time.perf_counter() - start)
+        start = time.perf_counter()
+        assert all(verify_many(zip(hashed, passwords), workers))
+        verify_rate = count / (time.perf_counter() - start)
+        base = base or hash_rate
+        print("{:>7} {:>12.1f} {:>12.1f} {:>7.2f}x".format(
+            workers, hash_rate, verify_rate, hash_rate / base))
+
+
+def synthetic_user_row(rng: random.Random) -> Dict[str, str]:
+    """ Build a users table row with the same columns as production """
+    first = rng.choice(["Marlene", "Kenneth", "Ada", "Bob", "Yasmine"])
+    last = rng.choice(["Wood", "Smith", "Lovelace", "Martin", "Alaoui"])
+    return {
+        "name": "{} {}".format(first, last),
+        "email": "{}.{}{}@example.com".format(first, last,
+                                              rng.randint(0, 9999)).lower(),
+        "phone": "({:03}) {:03}-{:04}".format(rng.randint(200, 999),
+                                              rng.randint(0, 999),
+                                              rng.randint(0, 9999)),
+        "ssn": "{:03}-{:02}-{:04}".format(rng.randint(0, 999),
+                                          rng.randint(0, 99),
+                                          rng.randint(0, 9999)),
+        "password": ''.join(rng.choice("abcdefXYZ0123?!")
+                            for _ in range(rng.randint(8, 16))),
+        "ip": "10.{}.{}.{}".format(rng.randint(0, 255), rng.randint(0, 255),
+                                   rng.randint(0, 255)),
+        "last_login": "2019-11-{:02} 06:14:24".format(rng.randint(1, 30)),
+        "user_agent": "Mozilla/5.0 (X11; Linux x86_64) Chrome/{}.0".format(
+            rng.randint(60, 120)),
+    }
+
+
+def synthetic_log_line(row: Dict[str, str], separator: str = ';') -> str:
+    """ Render a row the way the loggers see it """
+    return ''.join('{}={}{}'.format(key, value, separator)
+                   for key, value in row.items())
+
+
+def measure(func: Callable[[], object], number: int,
+            warmup: int = 5) -> Dict[str, float]:
+    """ Time func number times and sample its allocations
+    Timings and allocations are taken in separate runs so that
+    tracemalloc overhead does not skew the latency figures
+    """
+    for _ in range(warmup):
+        func()
+    timings = []
+    clock = time.perf_counter_ns
+    for _ in range(number):
+        start = clock()
+        func()
+        timings.append(clock() - start)
+    timings.sort()
+
+    samples = min(number, 50)
+    allocated = 0
+    tracemalloc.start()
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    def percentile(p: float) -> float:
+        """ Latency percentile in microseconds """
+        return timings[min(len(timings) - 1,
+                           int(len(timings) * p / 100))] / 1000
+
+    return {
+        "ops_per_sec": number / (sum(timings) / 1e9),
+        "p50_us": percentile(50),
+        "p95_us": percentile(95),
+        "p99_us": percentile(99),
+        "alloc_bytes_per_op": allocated / samples,
+    }
+
+
+def suite_cases(seed: int) -> List[tuple]:
+    """ (name, params, func, number) for every suite scenario """
+    rng = random.Random(seed)
+    rows = [synthetic_user_row(rng) for _ in range(100)]
+    lines = [synthetic_log_line(row) for row in rows]
+    cases = []
+
+    for extra in (0, 45, 495):
+        fields = list(PII_FIELDS) + synthetic_fields(extra)
+        for count in (1, 10, 100):
+            message = '\n'.join(lines[:count])
+            cases.append(("filter_datum",
+                          {"fields": len(fields), "lines": count,
+                           "bytes": len(message)},
+                          lambda f=fields, m=message: filter_datum(
+                              f, '***', m, ';'),
+                          200))
+
+    for backend in RedactingFormatter.BACKENDS:
+        formatter = RedactingFormatter(list(PII_FIELDS), backend=backend)
+        record = logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                                   lines[0], None, None)
+        cases.append(("RedactingFormatter.format", {"path": backend},
+                      lambda f=formatter, r=record: f.format(r), 2000))
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    record = logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                               "", (rows[0],), None)
+    cases.append(("RedactingFormatter.format", {"path": "structured"},
+                  lambda f=formatter, r=record: f.format(r), 2000))
+
+    for cost in (4, 6, 8, 10):
+        number = max(5, 400 >> (cost - 4))
+        hashed = hash_password("password", rounds=cost)
+        cases.append(("hash_password", {"cost": cost},
+                      lambda c=cost: hash_password("password", rounds=c),
+                      number))
+        cases.append(("is_valid", {"cost": cost},
+                      lambda h=hashed: is_valid(h, "password"), number))
+    return cases
+
+
+def git_commit() -> str:
+    """ Current commit, to tell result files apart """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(output: str = None, compare: str = None,
+                seed: int = 0) -> dict:
+    """ Reproducible suite: ops/sec, latency percentiles, allocations """
+    results = []
+    print("{:<26} {:<44} {:>10} {:>9} {:>9} {:>9} {:>8}".format(
+        "benchmark", "params", "ops/s", "p50 us", "p95 us", "p99 us",
+        "B/op"))
+    for name, params, func, number in suite_cases(seed):
+        result = {"name": name, "params": params}
+        result.update(measure(func, number))
+        results.append(result)
+        print("{:<26} {:<44} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f} "
+              "{:>8.0f}".format(
+                  name, json.dumps(params, sort_keys=True),
+                  result["ops_per_sec"], result["p50_us"], result["p95_us"],
+                  result["p99_us"], result["alloc_bytes_per_op"]))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if compare:
+        compare_reports(compare, report)
+    return report
+
+
+def compare_reports(baseline_path: str, report: dict,
+                    threshold: float = 0.9) -> None:
+    """ Print median latency speed-ups against an earlier result file
+    (the median is far less noisy than the mean throughput) """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(result: dict) -> str:
+        """ Identify a scenario across runs """
+        return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+    before = {key(result): result for result in baseline["results"]}
+    print("\nagainst {} ({})".format(baseline_path, baseline.get("commit")))
+    for result in report["results"]:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        ratio = old["p50_us"] / result["p50_us"]
+        print("{:<71} {:>6.2f}x{}".format(
+            key(result), ratio, "  REGRESSION" if ratio < threshold else ""))
+
+
+BENCHMARKS = {
+    "redaction": bench_redaction,
+    "bulk": bench_bulk,
+    "hashing": bench_hashing,
+    "suite": bench_suite,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the personal data helpers")
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help="one of {} (default: all)".format(
+                            ", ".join(BENCHMARKS)))
+    parser.add_argument('--output', help="suite: write results as JSON")
+    parser.add_argument('--compare', help="suite: JSON results to diff with")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="suite: seed for the synthetic data")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark: {}".format(", ".join(unknown)))
+    for name in args.names or BENCHMARKS:
+        if name == "suite":
+            bench_suite(args.output, args.compare, args.seed)
+        else:
+            BENCHMARKS[name]()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+""" Redact PII fields from existing log files on every core """
+
+import argparse
+import mmap
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Tuple
+
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def chunk_bounds(path: str, chunk_size: int = CHUNK_SIZE
+                 ) -> Iterator[Tuple[int, int]]:
+    """ Yield (start, end) offsets splitting the file on newlines """
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = mm.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            yield start, end
+            start = end
+
+
+def redact_chunk(path: str, start: int, end: int,
+                 fields: Tuple[str, ...] = PII_FIELDS) -> bytes:
+    """ Redact one newline-aligned chunk of a file """
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8', 'surrogateescape')
+    # The value pattern never crosses a newline, so a whole chunk
+    # redacts exactly like its lines would one by one
+    text = filter_datum(list(fields), RedactingFormatter.REDACTION, text,
+                        RedactingFormatter.SEPARATOR)
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def redact_files(paths: List[str], output: BinaryIO, workers: int = None,
+                 chunk_size: int = CHUNK_SIZE) -> int:
+    """ Redact files in a process pool and write them in order
+    Returns the number of input bytes processed
+    """
+    workers = workers or os.cpu_count()
+    processed = 0
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path in paths:
+            for start, end in chunk_bounds(path, chunk_size):
+                # Bound the chunks in flight so memory does not grow
+                # with the input size
+                if len(pending) >= 2 * workers:
+                    output.write(pending.popleft().result())
+                pending.append(executor.submit(redact_chunk, path,
+                                               start, end))
+                processed += end - start
+        while pending:
+            output.write(pending.popleft().result())
+    output.flush()
+    return processed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('files', nargs='+', help="log files to redact")
+    parser.add_argument('-o', '--output',
+                        help="output file (default: standard output)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="approximate chunk size in bytes")
+    args = parser.parse_args()
+    if args.output:
+        with open(args.output, 'wb') as out:
+            redact_files(args.files, out, args.workers, args.chunk_size)
+    else:
+        redact_files(args.files, sys.stdout.buffer, args.workers,
+                     args.chunk_size)
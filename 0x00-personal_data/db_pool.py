@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+""" Small thread-safe pool for DB-API connections """
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+
+class PooledConnection:
+    """ Proxy to a pooled connection: close() gives it back to the pool
+    """
+
+    def __init__(self, pool: 'ConnectionPool', connection: Any):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name: str) -> Any:
+        """ Delegate everything else to the real connection """
+        if self._connection is None:
+            raise AttributeError("connection returned to the pool")
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """ Release the connection instead of closing it """
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool.release(connection)
+
+    def __enter__(self) -> 'PooledConnection':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ConnectionPool:
+    """ Keeps up to size connections made by connect
+    Idle connections older than max_idle seconds are recycled and
+    every connection is health checked before it is handed out
+    """
+
+    def __init__(self, connect: Callable[[], Any], size: int = 5,
+                 max_idle: float = 300.0):
+        self._connect = connect
+        self.size = size
+        self.max_idle = max_idle
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, timeout: float = None) -> PooledConnection:
+        """ Borrow a healthy connection, waiting for a free slot """
+        if not self._slots.acquire(timeout=-1 if timeout is None
+                                   else timeout):
+            raise TimeoutError("no free connection in the pool")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    connection = self._connect()
+                    break
+                connection, released_at = item
+                if time.monotonic() - released_at <= self.max_idle \
+                        and self.is_healthy(connection):
+                    break
+                self._discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+        return PooledConnection(self, connection)
+
+    def release(self, connection: Any) -> None:
+        """ Take a connection back, dropping it if it is unusable """
+        try:
+            connection.rollback()
+        except Exception:
+            self._discard(connection)
+        else:
+            now = time.monotonic()
+            with self._lock:
+                # Most recently used connections are handed out first,
+                # so expired ones gather at the left end
+                while self._idle and now - self._idle[0][1] > self.max_idle:
+                    self._discard(self._idle.popleft()[0])
+                self._idle.append((connection, now))
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def is_healthy(connection: Any) -> bool:
+        """ Cheap liveness check (is_connected or SELECT 1) """
+        try:
+            if hasattr(connection, 'is_connected'):
+                return connection.is_connected()
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(connection: Any) -> None:
+        """ Close a connection that leaves the pool """
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """ Close every idle connection """
+        with self._lock:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
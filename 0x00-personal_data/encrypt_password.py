@@ -2,23 +2,127 @@
 """
 Utility functions for hashing and verifying passwords using bcrypt.
 """
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Tuple
+
 import bcrypt
 
 
-def hash_password(password: str) -> bytes:
+# New hashes never use a lower cost, whatever the calibration says
+MIN_COST = int(os.getenv('BCRYPT_MIN_COST', 12))
+MAX_COST = 16
+# bcrypt.gensalt()'s own default, used until a cost is configured
+DEFAULT_COST = 12
+LATENCY_BUDGET_MS = float(os.getenv('BCRYPT_LATENCY_BUDGET_MS', 250))
+_target_cost = None
+_cost_lock = threading.Lock()
+
+
+def calibrate_cost(budget_ms: float = LATENCY_BUDGET_MS,
+                   min_cost: int = MIN_COST, max_cost: int = MAX_COST,
+                   samples: int = 3) -> int:
+    """
+    Measures bcrypt.hashpw on this machine and picks a cost.
+
+    Args:
+        budget_ms (float): Latency allowed for one hash, in milliseconds.
+        min_cost (int): Cost returned even if it exceeds the budget.
+        max_cost (int): Highest cost to consider.
+        samples (int): Timings per cost; the fastest one is kept.
+
+    Returns:
+        int: The largest cost whose hash time fits in the budget.
+    """
+    cost = min_cost
+    for rounds in range(min_cost, max_cost + 1):
+        salt = bcrypt.gensalt(rounds)
+        elapsed = float('inf')
+        for _ in range(samples):
+            start = time.perf_counter()
+            bcrypt.hashpw(b'calibration', salt)
+            elapsed = min(elapsed, (time.perf_counter() - start) * 1000)
+        if elapsed > budget_ms:
+            break
+        cost = rounds
+        # Each extra round doubles the work: stop before a sure overrun
+        if elapsed * 2 > budget_ms:
+            break
+    return cost
+
+
+def calibrate_target_cost(budget_ms: float = LATENCY_BUDGET_MS) -> int:
+    """
+    Calibrates the machine and makes the result the cost of new hashes.
+
+    Meant for startup: it takes a few seconds, so hash_password never
+    runs it. Concurrent calls calibrate one at a time.
+    """
+    with _cost_lock:
+        cost = calibrate_cost(budget_ms)
+        _set_target_cost(cost)
+    return cost
+
+
+def target_cost() -> int:
+    """
+    Returns the bcrypt cost used for new hashes.
+
+    That is the cost set by set_target_cost() or calibrate_target_cost(),
+    else BCRYPT_COST, else DEFAULT_COST. It is never calibrated here.
+    """
+    if _target_cost is None:
+        with _cost_lock:
+            if _target_cost is None:
+                env_cost = os.getenv('BCRYPT_COST')
+                _set_target_cost(int(env_cost) if env_cost
+                                 else max(DEFAULT_COST, MIN_COST))
+    return _target_cost
+
+
+def _set_target_cost(cost: int) -> None:
+    """
+    Sets the cost of new hashes, refusing one below MIN_COST.
+    """
+    global _target_cost
+    if cost < MIN_COST:
+        raise ValueError("bcrypt cost {} is below the minimum {}".format(
+            cost, MIN_COST))
+    _target_cost = cost
+
+
+def set_target_cost(cost: int) -> None:
+    """
+    Overrides the bcrypt cost used for new hashes (at least MIN_COST).
+    """
+    with _cost_lock:
+        _set_target_cost(cost)
+
+
+if os.getenv('BCRYPT_CALIBRATE', '') not in ('', '0'):
+    # Calibrated at startup, on import, rather than in the first request
+    calibrate_target_cost()
+
+
+def hash_password(password: str, rounds: int = None) -> bytes:
     """
     Hashes the provided password using bcrypt.
 
     Args:
         password (str): The password to be hashed.
+        rounds (int): bcrypt cost (default: target_cost()).
 
     Returns:
         bytes: The salted, hashed password as a byte string.
     """
     # Encode the password to bytes before hashing
     password_bytes = password.encode('utf-8')
-    # Generate a salt and hash the password using bcrypt
-    hashed_password = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+    # Generate a salt at the target cost and hash the password using bcrypt
+    salt = bcrypt.gensalt(target_cost() if rounds is None else rounds)
+    hashed_password = bcrypt.hashpw(password_bytes, salt)
     return hashed_password
 
 
@@ -29,3 +133,77 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     # Encode the password to bytes before checking
     password_bytes = password.encode('utf-8')
     return bcrypt.checkpw(password_bytes, hashed_password)
+
+
+def hash_cost(hashed_password: bytes) -> int:
+    """
+    Returns the cost stored in a bcrypt hash ($2b$<cost>$...).
+    """
+    return int(hashed_password.split(b'$')[2])
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Tells whether a stored hash was made with another cost than the target.
+    """
+    return hash_cost(hashed_password) != target_cost()
+
+
+def check_password(hashed_password: bytes,
+                   password: str) -> Tuple[bool, bool]:
+    """
+    Validates a password and reports whether its hash should be redone.
+
+    Returns:
+        Tuple[bool, bool]: (valid, rehash). rehash is only True for a
+        valid password, so callers can store hash_password(password)
+        right after a successful login.
+    """
+    valid = is_valid(hashed_password, password)
+    return valid, valid and needs_rehash(hashed_password)
+
+
+def _ordered_map(func: Callable, items: Iterable,
+                 workers: int = None) -> Iterator:
+    """
+    Applies func to items in a thread pool, yielding results in order.
+
+    bcrypt releases the GIL, so threads hash in parallel. At most
+    2 * workers items are in flight, so results stream with bounded
+    memory whatever the input size.
+    """
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def hash_passwords(passwords: Iterable[str],
+                   workers: int = None) -> Iterator[bytes]:
+    """
+    Hashes many passwords in parallel.
+
+    Args:
+        passwords (Iterable[str]): The passwords to be hashed.
+        workers (int): Threads to use (default: CPU count).
+
+    Returns:
+        Iterator[bytes]: The hashed passwords, in input order.
+    """
+    return _ordered_map(hash_password, passwords, workers)
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                workers: int = None) -> Iterator[bool]:
+    """
+    Validates many (hashed_password, password) pairs in parallel.
+
+    Returns:
+        Iterator[bool]: One result per pair, in input order.
+    """
+    return _ordered_map(lambda pair: is_valid(*pair), pairs, workers)
@@ -2,20 +2,49 @@
 """ 0. Regex-ing """
 
 import re
-from typing import List
+import sys
+import time
+import queue
+import argparse
+import threading
+from functools import lru_cache
+from typing import (Iterable, List, Mapping, Optional, Pattern, Sequence,
+                    TextIO, Tuple)
 import logging
+import logging.handlers
 import mysql.connector
 import os
 
+from db_pool import ConnectionPool
+from field_automaton import field_automaton
+
+
+@lru_cache(maxsize=128)
+def redaction_pattern(fields: Tuple[str, ...], separator: str) -> Pattern:
+    """ Compile every field and the separator into one cached matcher """
+    alternation = '|'.join(f'(?:{field})' for field in fields)
+    return re.compile(f'(?:{alternation})=(?P<value>.*?){separator}')
+
 
 def filter_datum(fields: List[str], redaction: str, message: str,
                  separator: str) -> str:
-    """ Create regex pattern to match fields and
-    Replace matched fields with redaction"""
-    for field in fields:
-        message = re.sub(f'{field}=(.*?){separator}',
-                         f'{field}={redaction}{separator}', message)
-    return message
+    """ Replace the value of every field with redaction
+    in a single pass over the message """
+    tail = f'{redaction}{separator}'
+    if '\\' in tail:
+        # Templates may reference groups: keep the per-field semantics
+        for field in fields:
+            message = re.sub(f'{field}=(.*?){separator}',
+                             f'{field}={tail}', message)
+        return message
+    if not fields:
+        return message
+
+    def redact(match: re.Match) -> str:
+        """ Keep the matched field name, replace its value """
+        return message[match.start():match.start('value')] + tail
+
+    return redaction_pattern(tuple(fields), separator).sub(redact, message)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -25,38 +54,175 @@ class RedactingFormatter(logging.Formatter):
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
+    BACKENDS = ("regex", "automaton")
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], backend: str = "regex"):
+        """ backend "automaton" keeps the cost per message flat
+        for very large field lists """
         super(RedactingFormatter, self).__init__(self.FORMAT)
+        if backend not in self.BACKENDS:
+            raise ValueError("backend must be one of {}".format(
+                self.BACKENDS))
         self.fields = fields
+        self.backend = backend
 
     def format(self, record: logging.LogRecord) -> str:
         """ Displays filtered values from log records """
-        return filter_datum(self.fields, self.REDACTION,
-                            super().format(record), self.SEPARATOR)
+        data = self.structured_data(record)
+        if data is not None:
+            return self._format_structured(record, data)
+        message = super().format(record)
+        if self.backend == "automaton":
+            return field_automaton(tuple(self.fields)).redact(
+                message, self.REDACTION, self.SEPARATOR)
+        return filter_datum(self.fields, self.REDACTION, message,
+                            self.SEPARATOR)
+
+    @staticmethod
+    def structured_data(record: logging.LogRecord) -> Optional[Mapping]:
+        """ Fields passed as a mapping, either extra={"data": {...}}
+        or a single dict argument to a message without % placeholders """
+        data = getattr(record, 'data', None)
+        if isinstance(data, Mapping):
+            return data
+        if isinstance(record.args, Mapping) and '%' not in str(record.msg):
+            return record.args
+        return None
+
+    def _format_structured(self, record: logging.LogRecord,
+                           data: Mapping) -> str:
+        """ Mask by key lookup before rendering: no regex pass at all
+        (the message text itself is trusted to hold no PII) """
+        fields = set(self.fields)
+        masked = self.REDACTION + self.SEPARATOR
+        pairs = ''.join([f'{key}={masked}' if key in fields
+                         else f'{key}={value}{self.SEPARATOR}'
+                         for key, value in data.items()])
+        text = str(record.msg) if data is record.args \
+            else record.getMessage()
+        msg, args = record.msg, record.args
+        record.msg = '{} {}'.format(text, pairs) if text else pairs
+        record.args = None
+        try:
+            return super().format(record)
+        finally:
+            record.msg, record.args = msg, args
+
+
+class QueuedRedactingHandler(logging.handlers.QueueHandler):
+    """ Handler that only enqueues records on a bounded queue
+    A background thread formats (redacts) them and writes in batches
+    """
+
+    POLICIES = ("block", "drop-oldest", "drop-new")
+
+    def __init__(self, stream: TextIO = None, maxsize: int = 10000,
+                 policy: str = "block", batch_size: int = 256):
+        if policy not in self.POLICIES:
+            raise ValueError("policy must be one of {}".format(self.POLICIES))
+        super().__init__(queue.Queue(maxsize))
+        self.stream = sys.stderr if stream is None else stream
+        self.policy = policy
+        self.batch_size = batch_size
+        self.dropped_new = 0
+        self.dropped_oldest = 0
+        self._drop_lock = threading.Lock()
+        self._listener = threading.Thread(target=self._drain, daemon=True,
+                                          name="redacting-log-listener")
+        self._listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ Hand the record over untouched: formatting is the listener's job
+        so message args are rendered later and should not be mutated
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """ Put a record on the queue following the backpressure policy """
+        if self.policy == "block":
+            self.queue.put(record)
+            return
+        with self._drop_lock:
+            while True:
+                try:
+                    self.queue.put_nowait(record)
+                    return
+                except queue.Full:
+                    if self.policy == "drop-new":
+                        self.dropped_new += 1
+                        return
+                try:
+                    self.queue.get_nowait()
+                    self.dropped_oldest += 1
+                except queue.Empty:
+                    pass
+
+    @property
+    def dropped(self) -> int:
+        """ Total number of records lost to backpressure """
+        return self.dropped_new + self.dropped_oldest
+
+    def _drain(self) -> None:
+        """ Listener loop: redact and write whatever is queued in batches """
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is None:
+                    continue
+                try:
+                    lines.append(self.format(record))
+                except Exception:
+                    self.handleError(record)
+            if lines:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            if batch[-1] is None:
+                return
+
+    def close(self) -> None:
+        """ Write everything still queued, then stop the listener """
+        if self._listener.is_alive():
+            self.queue.put(None)
+            self._listener.join()
+        super().close()
 
 
 PII_FIELDS = ("name", "email", "password", "ssn", "phone")
+EXPORT_BATCH_SIZE = int(os.getenv('PERSONAL_DATA_EXPORT_BATCH_SIZE', 1000))
 
 
-def get_logger() -> logging.Logger:
-    """ Displays a logging.Logger object """
+def get_logger(queued: bool = False, policy: str = "block",
+               maxsize: int = 10000) -> logging.Logger:
+    """ Displays a logging.Logger object
+    With queued, redaction and I/O move to a background listener
+    and policy chooses what happens when maxsize records are pending
+    """
     user_logger = logging.getLogger("user_data")
     user_logger.setLevel(logging.INFO)
     user_logger.propagate = False
 
-    target_handler = logging.StreamHandler()
+    if queued:
+        target_handler = QueuedRedactingHandler(maxsize=maxsize,
+                                                policy=policy)
+    else:
+        target_handler = logging.StreamHandler()
     target_handler.setLevel(logging.INFO)
 
     formatter = RedactingFormatter(list(PII_FIELDS))
-    target_handle.setFormatter(formatter)
+    target_handler.setFormatter(formatter)
 
     user_logger.addHandler(target_handler)
     return user_logger
 
 
-def get_db() -> mysql.connector.connection.MYSQLConnection:
-    """ Connect to secure database to MySQL environment """
+def connect_db() -> mysql.connector.connection.MYSQLConnection:
+    """ Open a new connection to the MySQL database """
     db_connect = mysql.connector.connect(
         user=os.getenv('PERSONAL_DATA_DB_USERNAME', 'root'),
         password=os.getenv('PERSONAL_DATA_DB_PASSWORD', ''),
@@ -65,6 +231,75 @@ def get_db() -> mysql.connector.connection.MYSQLConnection:
     )
     return db_connect
 
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db() -> mysql.connector.connection.MYSQLConnection:
+    """ Connect to secure database to MySQL environment
+    When PERSONAL_DATA_DB_POOL_SIZE is set, connections come from a pool
+    (idle ones recycled after PERSONAL_DATA_DB_POOL_IDLE seconds)
+    and close() hands them back
+    """
+    global _db_pool
+    pool_size = int(os.getenv('PERSONAL_DATA_DB_POOL_SIZE', 0))
+    if pool_size <= 0:
+        return connect_db()
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = ConnectionPool(
+                connect_db, pool_size,
+                float(os.getenv('PERSONAL_DATA_DB_POOL_IDLE', 300)))
+    return _db_pool.acquire()
+
+
+def format_rows(headers: Sequence[str],
+                rows: Iterable[Sequence]) -> List[str]:
+    """ Render rows as `header=value; ` lines, one template per batch """
+    template = ''.join('{}={{}}; '.format(h.replace('{', '{{')
+                                           .replace('}', '}}'))
+                       for h in headers)
+    return [template.format(*row) for row in rows]
+
+
+def stream_users(stream: TextIO = None,
+                 batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """ Export the users table in fetchmany batches through an
+    unbuffered cursor, redacting each batch in one pass
+    Returns the number of exported rows
+    """
+    stream = sys.stderr if stream is None else stream
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    db = get_db()
+    cursor = db.cursor(buffered=False)
+    cursor.execute("SELECT * FROM users;")
+    headers = [field[0] for field in cursor.description]
+
+    count = 0
+    start = time.perf_counter()
+    rows = cursor.fetchmany(batch_size)
+    while rows:
+        # Render without redaction, then redact the whole batch at once:
+        # values never span lines, so the result matches per-record format
+        block = '\n'.join(
+            logging.Formatter.format(formatter, logging.LogRecord(
+                "user_data", logging.INFO, __file__, 0, line, None, None))
+            for line in format_rows(headers, rows))
+        stream.write(filter_datum(formatter.fields, formatter.REDACTION,
+                                  block, formatter.SEPARATOR) + '\n')
+        count += len(rows)
+        rows = cursor.fetchmany(batch_size)
+    stream.flush()
+    elapsed = time.perf_counter() - start
+
+    cursor.close()
+    db.close()
+    print("{} rows in {:.2f}s ({:.0f} rows/sec)".format(
+        count, elapsed, count / elapsed if elapsed else 0))
+    return count
+
+
 def main() -> None:
     """ Obtain database connection using get_db
     retrieve all role in the users table and display
@@ -77,10 +312,7 @@ def main() -> None:
     headers = [field[0] for field in cursor.description]
     logger = get_logger()
 
-    for sd in cursor:
-        data_r = ''
-        for a, b in zip(sd, headers):
-            data_r += a'{b}={(a)}; '
+    for data_r in format_rows(headers, cursor):
         logger.info(data_r)
 
     cursor.close()
@@ -88,4 +320,13 @@ def main() -> None:
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Display redacted users")
+    parser.add_argument('--stream', action='store_true',
+                        help="batched export with bounded memory")
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE,
+                        help="rows fetched per batch in --stream mode")
+    args = parser.parse_args()
+    if args.stream:
+        stream_users(batch_size=args.batch_size)
+    else:
+        main()
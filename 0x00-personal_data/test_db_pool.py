@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+""" Tests of db_pool, against sqlite3 and a fake connector
+Run: python3 -m unittest test_db_pool
+"""
+
+import sqlite3
+import threading
+import time
+import unittest
+
+from db_pool import ConnectionPool
+
+
+class FakeCursor:
+    """ DB-API cursor answering every query with one row """
+
+    def execute(self, sql: str) -> None:
+        pass
+
+    def fetchall(self) -> list:
+        return [(1,)]
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+    """ DB-API connection that records its state and can break """
+
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+
+    def cursor(self) -> 'FakeCursor':
+        if self.closed or self.broken:
+            raise RuntimeError("connection lost")
+        return FakeCursor()
+
+    def rollback(self) -> None:
+        if self.closed or self.broken:
+            raise RuntimeError("connection lost")
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeConnector:
+    """ Callable making FakeConnections, keeping every one made """
+
+    def __init__(self):
+        self.made = []
+
+    def __call__(self) -> FakeConnection:
+        connection = FakeConnection()
+        self.made.append(connection)
+        return connection
+
+
+class TestConnectionPool(unittest.TestCase):
+    """ ConnectionPool """
+
+    def test_sqlite_acquire_release(self):
+        """ A released sqlite3 connection is reused, uncommitted
+        work rolled back """
+        pool = ConnectionPool(lambda: sqlite3.connect(
+            ":memory:", check_same_thread=False), size=2)
+        with pool.acquire() as db:
+            first = db._connection
+            db.execute("CREATE TABLE t (x)")
+            db.commit()
+            db.execute("INSERT INTO t VALUES (1)")
+        with pool.acquire() as db:
+            self.assertIs(db._connection, first)
+            self.assertEqual(
+                db.execute("SELECT COUNT(*) FROM t").fetchone(), (0,))
+        with self.assertRaises(AttributeError):
+            db.cursor()
+        pool.close()
+
+    def test_reuse(self):
+        """ Acquire/release cycles share one connection """
+        connect = FakeConnector()
+        pool = ConnectionPool(connect, size=3)
+        for _ in range(5):
+            pool.acquire().close()
+        self.assertEqual(len(connect.made), 1)
+
+    def test_double_close(self):
+        """ Closing a proxy twice releases its slot once """
+        pool = ConnectionPool(FakeConnector(), size=1)
+        db = pool.acquire()
+        db.close()
+        db.close()
+        pool.acquire(timeout=0.1).close()
+        with pool.acquire(timeout=0.1):
+            with self.assertRaises(TimeoutError):
+                pool.acquire(timeout=0.05)
+
+    def test_exhausted_timeout(self):
+        """ acquire times out while every connection is out, and
+        succeeds once one comes back """
+        pool = ConnectionPool(FakeConnector(), size=2)
+        held = [pool.acquire(), pool.acquire()]
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        threading.Timer(0.05, held.pop().close).start()
+        pool.acquire(timeout=2).close()
+
+    def test_idle_recycling(self):
+        """ Connections idle over max_idle are closed and replaced """
+        connect = FakeConnector()
+        pool = ConnectionPool(connect, size=2, max_idle=0.05)
+        pool.acquire().close()
+        time.sleep(0.1)
+        with pool.acquire() as db:
+            self.assertIs(db._connection, connect.made[1])
+        self.assertTrue(connect.made[0].closed)
+        self.assertFalse(connect.made[1].closed)
+
+    def test_broken_on_release(self):
+        """ A connection failing its rollback is dropped on release """
+        connect = FakeConnector()
+        pool = ConnectionPool(connect, size=1)
+        with pool.acquire():
+            connect.made[0].broken = True
+        self.assertTrue(connect.made[0].closed)
+        with pool.acquire(timeout=0.1) as db:
+            self.assertIs(db._connection, connect.made[1])
+
+    def test_broken_while_idle(self):
+        """ An idle connection failing the health check is dropped
+        instead of handed out """
+        connect = FakeConnector()
+        pool = ConnectionPool(connect, size=1)
+        pool.acquire().close()
+        connect.made[0].broken = True
+        with pool.acquire(timeout=0.1) as db:
+            self.assertIs(db._connection, connect.made[1])
+        self.assertTrue(connect.made[0].closed)
+
+    def test_connect_error(self):
+        """ A failing connect gives its slot back """
+        def connect():
+            raise RuntimeError("unreachable")
+        pool = ConnectionPool(connect, size=1)
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                pool.acquire(timeout=0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -92,16 +92,15 @@ class BasicAuth(Auth):
             return None
 
         try:
-            # Search for users with the given email
-            found_users = User.search({'email': user_email})
+            # Users with the given email, produced one at a time as the
+            # storage reads them, so errors can come from the loop too
+            for user in User.query({'email': user_email}):
+                # Check if the password is valid for this user
+                if user.is_valid_password(user_pwd):
+                    return user
         except Exception:
             return None
 
-        # Check if the password is valid for any of the found users
-        for user in found_users:
-            if user.is_valid_password(user_pwd):
-                return user
-
         return None
 
     def current_user(self, request=None) -> TypeVar('User'):
@@ -2,18 +2,137 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from datetime import datetime
+from flask import Response, abort, jsonify, request, url_for
+from models.base import TIMESTAMP_FORMAT
+from models.query import Range
 from models.user import User
+from typing import Iterable, Iterator
+import hashlib
+
+
+# Largest page of GET /api/v1/users?limit=
+MAX_PAGE_SIZE = 1000
+# Users serialized per chunk of a streamed response
+STREAM_BATCH = 100
+# Largest result of GET /api/v1/users/search?limit=
+MAX_SUGGESTIONS = 100
+
+
+def stream_users(users: Iterable[User], ndjson: bool = False) -> Iterator[str]:
+    """ Serialize users incrementally, STREAM_BATCH per chunk:
+    as one JSON list, or as one JSON object per line
+    """
+    chunk = [] if ndjson else ["["]
+    count = 0
+    for user in users:
+        text = user.json_text()
+        if ndjson:
+            chunk.append(text + "\n")
+        else:
+            chunk.append(text if count == 0 else ", " + text)
+        count += 1
+        if count % STREAM_BATCH == 0:
+            yield "".join(chunk)
+            chunk = []
+    if not ndjson:
+        chunk.append("]")
+    yield "".join(chunk)
+
+
+def user_response(user: User, status: int = 200) -> Response:
+    """ JSON of user with its strong ETag; on GET, 304 Not Modified
+    (nothing serialized) when If-None-Match holds that ETag
+    """
+    tag = user.etag()
+    if request.method == 'GET' and request.if_none_match.contains_weak(tag):
+        response = Response(status=304)
+    else:
+        response = jsonify(user.to_json())
+        response.status_code = status
+    response.set_etag(tag)
+    return response
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query string (optional):
+      - limit: page size, 1 to MAX_PAGE_SIZE (pages are ordered by ID)
+      - after: ID of the last User of the previous page
+      - updated_since: only Users updated at or after this time
+        (TIMESTAMP_FORMAT), read from the sorted updated_at index
+      - format: ndjson for one User JSON per line
     Return:
-      - list of all User objects JSON represented
+      - list of User objects JSON represented, streamed
+      - Link header to the next page, when there may be one
+      - ETag of a page, and 304 if If-None-Match holds it
+      - 400 if limit or updated_since isn't valid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    updated_since = request.args.get('updated_since')
+    fmt = request.args.get('format')
+    headers = {}
+    where = {}
+    if updated_since is not None:
+        try:
+            where['updated_at'] = Range(low=datetime.strptime(
+                updated_since, TIMESTAMP_FORMAT))
+        except ValueError:
+            return jsonify({'error': "updated_since must match {}".format(
+                TIMESTAMP_FORMAT)}), 400
+    if limit is None and after is None:
+        users = User.query(where)
+    else:
+        try:
+            limit = MAX_PAGE_SIZE if limit is None else int(limit)
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            return jsonify({'error': "limit must be between 1 and {}".format(
+                MAX_PAGE_SIZE)}), 400
+        if after is not None:
+            where['id'] = Range(low=after, exclusive_low=True)
+        users = list(User.query(where, order_by='id', limit=limit))
+        if len(users) == limit:
+            headers['Link'] = '<{}>; rel="next"'.format(url_for(
+                'app_views.view_all_users', limit=limit, after=users[-1].id,
+                updated_since=updated_since, format=fmt))
+        # A page is a bounded list: its ETag derives from those of its users
+        tag = hashlib.sha1(" ".join(
+            [str(fmt)] + [user.etag() for user in users]).encode()).hexdigest()
+        headers['ETag'] = '"{}"'.format(tag)
+        if request.if_none_match.contains_weak(tag):
+            return Response(status=304, headers=headers)
+    ndjson = fmt == 'ndjson'
+    return Response(stream_users(users, ndjson), headers=headers,
+                    mimetype='application/x-ndjson' if ndjson
+                    else 'application/json')
+
+
+@app_views.route('/users/search', methods=['GET'], strict_slashes=False)
+def search_users() -> str:
+    """ GET /api/v1/users/search
+    Query string:
+      - q: start of an email, first name or last name (any case)
+      - limit (optional): 1 to MAX_SUGGESTIONS results, 10 by default
+    Return:
+      - list of matching User objects JSON represented, best first:
+        exact matches, then email, first name and last name matches
+      - 400 if q is missing or limit isn't valid
+    """
+    text = request.args.get('q')
+    if text is None or text == "":
+        return jsonify({'error': "q missing"}), 400
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_SUGGESTIONS:
+        return jsonify({'error': "limit must be between 1 and {}".format(
+            MAX_SUGGESTIONS)}), 400
+    return jsonify([user.to_json() for user in User.suggest(text, limit)])
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -22,7 +141,8 @@ def view_one_user(user_id: str = None) -> str:
     Path parameter:
       - User ID
     Return:
-      - User object JSON represented
+      - User object JSON represented, with its ETag
+      - 304 if If-None-Match holds the ETag
       - 404 if the User ID doesn't exist
     """
     if user_id is None:
@@ -30,7 +150,7 @@ def view_one_user(user_id: str = None) -> str:
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    return user_response(user)
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -83,7 +203,7 @@ def create_user() -> str:
             user.first_name = rj.get("first_name")
             user.last_name = rj.get("last_name")
             user.save()
-            return jsonify(user.to_json()), 201
+            return user_response(user, 201)
         except Exception as e:
             error_msg = "Can't create User: {}".format(e)
     return jsonify({'error': error_msg}), 400
@@ -119,4 +239,111 @@ def update_user(user_id: str = None) -> str:
     if rj.get('last_name') is not None:
         user.last_name = rj.get('last_name')
     user.save()
-    return jsonify(user.to_json()), 200
+    return user_response(user)
+
+
+# Most items one POST /api/v1/users/batch may carry
+MAX_BATCH_SIZE = 10000
+
+
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def batch_users() -> str:
+    """ POST /api/v1/users/batch
+    JSON body (each list optional):
+      - create: list of {email, password, first_name, last_name}
+      - update: list of {id, first_name, last_name}
+      - delete: list of User IDs
+    Every item is validated first (an ID may only be updated or deleted
+    once per batch), then the valid ones are applied and persisted with
+    a single write
+    Return:
+      - for each list, one result per item, in order:
+        {"status": 201 or 200, "user": ...}, {"status": 200} for a
+        delete, or {"status": 400 or 404, "error": ...}
+      - 400 if the body isn't an object of lists or holds too many items
+    """
+    rj = None
+    try:
+        rj = request.get_json()
+    except Exception:
+        rj = None
+    if type(rj) is not dict or any(
+            type(rj.get(key, [])) is not list
+            for key in ('create', 'update', 'delete')):
+        return jsonify({'error': "Wrong format"}), 400
+    creates = rj.get('create', [])
+    updates = rj.get('update', [])
+    deletes = rj.get('delete', [])
+    if len(creates) + len(updates) + len(deletes) > MAX_BATCH_SIZE:
+        return jsonify({'error': "At most {} items per batch".format(
+            MAX_BATCH_SIZE)}), 400
+
+    results = {'create': [], 'update': [], 'delete': []}
+    saves = []
+    removes = []
+    seen = set()
+
+    def check(item) -> str:
+        """ Error of a User ID, or None
+        """
+        if type(item) is not str or User.get(item) is None:
+            return "Not found"
+        if item in seen:
+            return "Duplicate ID in batch"
+        seen.add(item)
+        return None
+
+    for item in creates:
+        error_msg = None
+        if type(item) is not dict:
+            error_msg = "Wrong format"
+        elif item.get("email", "") == "":
+            error_msg = "email missing"
+        elif item.get("password", "") == "":
+            error_msg = "password missing"
+        if error_msg is not None:
+            results['create'].append({'status': 400, 'error': error_msg})
+            continue
+        user = User()
+        user.email = item.get("email")
+        user.password = item.get("password")
+        user.first_name = item.get("first_name")
+        user.last_name = item.get("last_name")
+        saves.append(user)
+        results['create'].append({'status': 201, 'user': user})
+
+    for item in updates:
+        if type(item) is not dict:
+            results['update'].append({'status': 400, 'error': "Wrong format"})
+            continue
+        error_msg = check(item.get('id'))
+        if error_msg is not None:
+            results['update'].append({
+                'status': 404 if error_msg == "Not found" else 400,
+                'error': error_msg})
+            continue
+        user = User.get(item.get('id'))
+        if item.get('first_name') is not None:
+            user.first_name = item.get('first_name')
+        if item.get('last_name') is not None:
+            user.last_name = item.get('last_name')
+        saves.append(user)
+        results['update'].append({'status': 200, 'user': user})
+
+    for item in deletes:
+        error_msg = check(item)
+        if error_msg is not None:
+            results['delete'].append({
+                'status': 404 if error_msg == "Not found" else 400,
+                'error': error_msg})
+            continue
+        removes.append(User.get(item))
+        results['delete'].append({'status': 200})
+
+    User.bulk(saves, removes)
+    # Serialized after the write, so updated_at is the stored one
+    for key in ('create', 'update'):
+        for result in results[key]:
+            if 'user' in result:
+                result['user'] = result['user'].to_json()
+    return jsonify(results), 200
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+""" Benchmarks for the models
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Callable, List
+
+from models.base import TIMESTAMP_FORMAT
+from models.storage import STORAGES, JsonStorage
+from models.user import User
+
+
+def synthetic_records(count: int) -> List[dict]:
+    """ User records as load_from_file reads them
+    """
+    return [{
+        "id": str(uuid.uuid4()),
+        "created_at": "2020-01-01T00:00:{:02}".format(i % 60),
+        "updated_at": "2021-01-01T00:00:{:02}".format(i % 60),
+        "email": "user{}@example.com".format(i),
+        "_password": uuid.uuid4().hex * 2,
+        "first_name": "First{}".format(i),
+        "last_name": "Last{}".format(i),
+    } for i in range(count)]
+
+
+class DictUser():
+    """ Former layout: attributes in __dict__, timestamps as datetime
+    """
+
+    def __init__(self, **kwargs):
+        self.id = kwargs.get('id')
+        self.created_at = datetime.strptime(kwargs.get('created_at'),
+                                            TIMESTAMP_FORMAT)
+        self.updated_at = datetime.strptime(kwargs.get('updated_at'),
+                                            TIMESTAMP_FORMAT)
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+
+def bytes_per_object(build: Callable[[dict], object],
+                     records: List[dict]) -> float:
+    """ Memory held by the objects built from records, per object
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [build(record) for record in records]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objs
+    return used / len(records)
+
+
+def read_timestamps(record: dict) -> User:
+    """ User whose timestamps have been read (parsed) once
+    """
+    user = User(**record)
+    user.created_at
+    user.updated_at
+    return user
+
+
+def bench_memory(count: int = 20000):
+    """ Bytes per user held by the objects themselves (the attribute
+    strings are shared with the input records and not counted):
+    former __dict__ layout vs slotted User
+    """
+    records = synthetic_records(count)
+    print("{:<34} {:>10} {:>8}".format("layout", "bytes/obj", "factor"))
+    baseline = None
+    for name, build in (
+            ("__dict__ + datetime (former)", lambda r: DictUser(**r)),
+            ("__slots__, timestamps unread", lambda r: User(**r)),
+            ("__slots__, timestamps read", read_timestamps)):
+        used = bytes_per_object(build, records)
+        baseline = baseline or used
+        print("{:<34} {:>10.0f} {:>7.2f}x".format(
+            name, used, baseline / used))
+
+
+def bench_serialization(count: int = 20000, rounds: int = 5):
+    """ Users serialized per second by the views: uncached (former
+    to_json + json.dumps each time) vs the cached JSON text
+    """
+    users = [User(**record) for record in synthetic_records(count)]
+    print("{:<34} {:>12}".format("serialization", "users/s"))
+    for name, serialize in (
+            ("uncached", lambda u: json.dumps(u.build_json())),
+            ("cached", lambda u: u.json_text())):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for user in users:
+                serialize(user)
+        elapsed = time.perf_counter() - start
+        print("{:<34} {:>12.0f}".format(name, count * rounds / elapsed))
+
+
+def stress_worker(client, worker: int, ops: int, alive: set,
+                  errors: Counter, lock: threading.Lock):
+    """ Create/update/list/delete users through the API
+    """
+    mine = []
+    for i in range(ops):
+        try:
+            r = client.post("/api/v1/users", json={
+                "email": "w{}-{}@example.com".format(worker, i),
+                "password": "pwd"})
+            if r.status_code != 201:
+                errors["POST {}".format(r.status_code)] += 1
+                continue
+            user_id = r.get_json()["id"]
+            mine.append(user_id)
+            with lock:
+                alive.add(user_id)
+            r = client.put("/api/v1/users/{}".format(user_id),
+                           json={"first_name": "F{}".format(i)})
+            if r.status_code != 200:
+                errors["PUT {}".format(r.status_code)] += 1
+            r = client.get("/api/v1/users")
+            if r.status_code != 200:
+                errors["GET {}".format(r.status_code)] += 1
+            if i % 3 == 0:
+                user_id = mine.pop(0)
+                with lock:
+                    alive.discard(user_id)
+                r = client.delete("/api/v1/users/{}".format(user_id))
+                if r.status_code != 200:
+                    errors["DELETE {}".format(r.status_code)] += 1
+        except Exception as e:
+            errors["{}: {}".format(type(e).__name__, e)] += 1
+
+
+def race_worker(method: str, users: List[User], errors: Counter,
+                barrier: threading.Barrier):
+    """ Save or remove each user, in step with the worker doing the other
+    """
+    for user in users:
+        barrier.wait()
+        try:
+            getattr(user, method)()
+        except Exception as e:
+            errors["{}: {}".format(type(e).__name__, e)] += 1
+
+
+def race_journal(pairs: int, count: int, errors: Counter) -> tuple:
+    """ Pairs of workers saving and removing the same users at once in
+    journal mode; return the IDs of those left after, and reloaded
+    """
+    previous = STORAGES.get(User)
+    STORAGES[User] = JsonStorage(User, journal=True)
+    interval = sys.getswitchinterval()
+    try:
+        User.load_from_file()
+        users = []
+        for i in range(pairs * count):
+            user = User(email="race{}@example.com".format(i))
+            user.save()
+            users.append(user)
+        workers = []
+        for n in range(pairs):
+            barrier = threading.Barrier(2)
+            for method in ("save", "remove"):
+                workers.append(threading.Thread(
+                    target=race_worker,
+                    args=(method, users[n::pairs], errors, barrier)))
+        # Switch threads often, for the writes to interleave
+        sys.setswitchinterval(1e-6)
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        sys.setswitchinterval(interval)
+        User.flush()
+        left = {user.id for user in users if User.get(user.id)}
+        User.load_from_file()
+        reloaded = {user.id for user in users if User.get(user.id)}
+    finally:
+        sys.setswitchinterval(interval)
+        STORAGES[User] = previous
+    return left, reloaded
+
+
+def bench_concurrency(threads: int = 8, ops: int = 100):
+    """ Stress test: concurrent create/update/delete/list through the
+    Flask test client, then check the store against what was acked;
+    then overlapping saves and removes of the same users in journal
+    mode, checking the journal against memory
+    (runs in a temporary directory)
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            from api.v1.app import app
+            app.testing = True
+            alive = set()
+            errors = Counter()
+            lock = threading.Lock()
+            workers = [threading.Thread(
+                target=stress_worker,
+                args=(app.test_client(), n, ops, alive, errors, lock))
+                for n in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            User.flush()
+            listed = {u["id"] for u in app.test_client().get(
+                "/api/v1/users").get_json()}
+            User.load_from_file()
+            reloaded = {user.id for user in User.all()}
+
+            raced, raced_reloaded = race_journal(threads // 2, ops, errors)
+        finally:
+            os.chdir(cwd)
+    requests = threads * ops * 3 + threads * ((ops + 2) // 3)
+    print("{} threads, {} requests in {:.2f}s ({:.0f} req/s)".format(
+        threads, requests, elapsed, requests / elapsed))
+    for error, count in errors.most_common():
+        print("  error x{}: {}".format(count, error))
+    print("listed == acked: {}, reloaded == acked: {}".format(
+        listed == alive, reloaded == alive))
+    print("journal races: {} of {} users left, reloaded == left: {}"
+          .format(len(raced), threads // 2 * ops, raced_reloaded == raced))
+    if errors or listed != alive or reloaded != alive or \
+            raced_reloaded != raced:
+        raise SystemExit(1)
+
+
+def bench_import(count: int = 2000):
+    """ Users imported per second through the API: one POST per user
+    vs one POST /api/v1/users/batch (runs in a temporary directory)
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            from api.v1.app import app
+            client = app.test_client()
+            items = [{"email": "import{}@example.com".format(i),
+                      "password": "pwd"} for i in range(count)]
+            print("{:<34} {:>12}".format("import of {}".format(count),
+                                         "users/s"))
+            start = time.perf_counter()
+            for item in items:
+                client.post("/api/v1/users", json=item)
+            elapsed = time.perf_counter() - start
+            print("{:<34} {:>12.0f}".format("POST /users", count / elapsed))
+            start = time.perf_counter()
+            r = client.post("/api/v1/users/batch", json={"create": items})
+            elapsed = time.perf_counter() - start
+            assert all(item["status"] == 201
+                       for item in r.get_json()["create"])
+            print("{:<34} {:>12.0f}".format("POST /users/batch",
+                                            count / elapsed))
+        finally:
+            os.chdir(cwd)
+
+
+def bench_search(count: int = 200000, rounds: int = 200):
+    """ Type-ahead lookups per second: filtering every user (former
+    client-side search) vs User.suggest on the prefix indexes
+    (runs in a temporary directory)
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            User.load_from_file()
+            User.bulk([User(**record) for record in synthetic_records(count)])
+            texts = ["first{}".format(i * 7919 % count)
+                     for i in range(rounds)]
+
+            def scan(text: str) -> list:
+                text = text.lower()
+                return [user for user in User.all()
+                        if any(type(value) is str and
+                               value.lower().startswith(text)
+                               for value in (user.email, user.first_name,
+                                             user.last_name))][:10]
+
+            print("{:<34} {:>12}".format("search in {}".format(count),
+                                         "lookups/s"))
+            # A full scan per lookup is slow: time fewer of them
+            for name, search, lookups in (
+                    ("filter every user", scan, texts[:rounds // 20]),
+                    ("User.suggest", User.suggest, texts)):
+                start = time.perf_counter()
+                for text in lookups:
+                    search(text)
+                elapsed = time.perf_counter() - start
+                print("{:<34} {:>12.0f}".format(name, len(lookups) / elapsed))
+        finally:
+            os.chdir(cwd)
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "serialization": bench_serialization,
+    "concurrency": bench_concurrency,
+    "import": bench_import,
+    "search": bench_search,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the models")
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help="one of {} (default: all)".format(
+                            ", ".join(BENCHMARKS)))
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark: {}".format(", ".join(unknown)))
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
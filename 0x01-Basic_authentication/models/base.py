@@ -2,38 +2,180 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from functools import lru_cache
+from os import getenv
+from typing import TypeVar, List, Iterable, Iterator, Tuple
+import hashlib
 import json
+import os
+import threading
+import time
 import uuid
+from models.storage import Storage, storage_for
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+# "uuid4": random IDs; "uuid7": time-ordered IDs, sorting as created
+ID_FORMAT = getenv("BASE_ID_FORMAT", "uuid4")
+_uuid7_last = (0, 0)
+_uuid7_lock = threading.Lock()
+
+
+def uuid7() -> str:
+    """ Time-ordered UUID (RFC 9562 version 7): 48 bits of Unix time in
+    milliseconds, then 74 random bits incremented when the clock
+    doesn't move, so IDs always sort in creation order
+    """
+    global _uuid7_last
+    with _uuid7_lock:
+        ms = time.time_ns() // 1000000
+        last_ms, last_rand = _uuid7_last
+        if ms > last_ms:
+            rand = int.from_bytes(os.urandom(10), 'big') >> 6
+        else:
+            ms, rand = last_ms, last_rand + 1
+            if rand >> 74:
+                ms, rand = ms + 1, 0
+        _uuid7_last = (ms, rand)
+    value = (ms << 80 | 0x7 << 76 | (rand >> 62) << 64 |
+             0x2 << 62 | rand & ((1 << 62) - 1))
+    return str(uuid.UUID(int=value))
+
+
+def utcnow() -> datetime:
+    """ Current UTC time to the second, as timestamps are persisted
+    """
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def new_id() -> str:
+    """ ID of a new object, in the ID_FORMAT
+    """
+    if ID_FORMAT == "uuid7":
+        return uuid7()
+    return str(uuid.uuid4())
+
+
+class Timestamp():
+    """ datetime attribute kept as its TIMESTAMP_FORMAT string
+    until it is first read; stored in the `_<name>` slot
+    """
+
+    def __set_name__(self, owner: type, name: str):
+        """ Remember the attribute and slot names
+        """
+        self.name = name
+        self.slot = "_{}".format(name)
+
+    def __get__(self, obj, objtype: type = None):
+        """ Parse the stored string on first read
+        """
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if type(value) is str:
+            value = datetime.strptime(value, TIMESTAMP_FORMAT)
+            # Same value, parsed: the cached JSON forms stay valid
+            object.__setattr__(obj, self.slot, value)
+        return value
+
+    def __set__(self, obj, value):
+        """ Store a datetime or a TIMESTAMP_FORMAT string
+        """
+        setattr(obj, self.slot, value)
+
+
+@lru_cache(maxsize=None)
+def slot_attributes(cls: type) -> Tuple[Tuple[str, str], ...]:
+    """ (attribute name, slot name) of every slot of cls, base first
+    """
+    attributes = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        for slot in (slots,) if type(slots) is str else slots:
+            if slot in ('__dict__', '__weakref__', '_cache'):
+                continue
+            timestamp = klass.__dict__.get(slot[1:])
+            if slot[0] == '_' and isinstance(timestamp, Timestamp):
+                attributes.append((timestamp.name, slot))
+            else:
+                attributes.append((slot, slot))
+    return tuple(attributes)
 
 
 class Base():
     """ Base class
+    Attributes live in __slots__ to keep millions of objects small;
+    subclasses without __slots__ still get a __dict__
     """
 
+    # _cache holds the JSON forms served by the API, dropped on any set
+    __slots__ = ('id', '_created_at', '_updated_at', '_cache')
+
+    # Attributes indexed by the storage backend and used by search()
+    INDEXED_ATTRIBUTES = ()
+    # Attributes kept in order (ranges, sorted pages); the timestamps are
+    # keyed on their stored form, so indexing doesn't parse them
+    SORTED_ATTRIBUTES = ('id', 'created_at', 'updated_at')
+    # Attributes of the type-ahead search (suggest), prefix-indexed
+    SEARCH_ATTRIBUTES = ()
+
+    created_at = Timestamp()
+    updated_at = Timestamp()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.id = kwargs['id'] if 'id' in kwargs else new_id()
+        # Timestamp strings are only parsed when read
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = kwargs.get('created_at')
         else:
-            self.created_at = datetime.utcnow()
+            self.created_at = utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = kwargs.get('updated_at')
         else:
-            self.updated_at = datetime.utcnow()
+            self.updated_at = utcnow()
+
+    @staticmethod
+    def sortable(value: object) -> str:
+        """ Key of a value in a sorted index: strings as they are,
+        datetimes in TIMESTAMP_FORMAT (same order; microseconds, if any,
+        appended), None otherwise
+        """
+        if type(value) is str:
+            return value
+        if type(value) is datetime:
+            key = value.strftime(TIMESTAMP_FORMAT)
+            if value.microsecond:
+                key += ".{:06d}".format(value.microsecond)
+            return key
+        return None
+
+    @staticmethod
+    def searchable(value: object) -> str:
+        """ Key of a value in a search index: strings in lower case,
+        None otherwise
+        """
+        if type(value) is str:
+            return value.lower()
+        return None
+
+    def stored(self, name: str) -> object:
+        """ Value of an attribute as stored: a timestamp not read yet
+        is still its TIMESTAMP_FORMAT string
+        """
+        timestamp = getattr(self.__class__, name, None)
+        if isinstance(timestamp, Timestamp):
+            name = timestamp.slot
+        return getattr(self, name, None)
+
+    def __setattr__(self, name: str, value: object):
+        """ Set an attribute and drop the cached JSON forms
+        (values mutated in place are not tracked)
+        """
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_cache', None)
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -44,11 +186,58 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def attributes(self) -> Iterator[Tuple[str, object]]:
+        """ (name, stored value) of every attribute set on the object
+        """
+        for name, slot in slot_attributes(self.__class__):
+            try:
+                yield name, getattr(self, slot)
+            except AttributeError:
+                continue
+        yield from getattr(self, '__dict__', {}).items()
+
+    def cached(self) -> dict:
+        """ Cache of the JSON forms, empty until they are asked for
+        """
+        cache = getattr(self, '_cache', None)
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, '_cache', cache)
+        return cache
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
+        The public form is cached until an attribute is set
+        """
+        if for_serialization:
+            return self.build_json(True)
+        cache = self.cached()
+        if 'json' not in cache:
+            cache['json'] = self.build_json()
+        return dict(cache['json'])
+
+    def json_text(self) -> str:
+        """ to_json() serialized, cached until an attribute is set
+        """
+        cache = self.cached()
+        if 'text' not in cache:
+            cache['text'] = json.dumps(self.to_json())
+        return cache['text']
+
+    def etag(self) -> str:
+        """ Strong entity tag of to_json(), cached until an attribute is set
+        """
+        cache = self.cached()
+        if 'etag' not in cache:
+            cache['etag'] = hashlib.sha1(
+                self.json_text().encode()).hexdigest()
+        return cache['etag']
+
+    def build_json(self, for_serialization: bool = False) -> dict:
+        """ JSON dictionary of the attributes, without the cache
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self.attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,56 +246,70 @@ class Base():
                 result[key] = value
         return result
 
+    def project(self, fields: Iterable[str]) -> dict:
+        """ JSON dictionary of the given attributes only
+        """
+        result = {}
+        for field in fields:
+            value = getattr(self, field, None)
+            if type(value) is datetime:
+                value = value.strftime(TIMESTAMP_FORMAT)
+            result[field] = value
+        return result
+
+    @classmethod
+    def storage(cls) -> Storage:
+        """ Storage backend of the class, chosen by BASE_STORAGE
+        """
+        return storage_for(cls)
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        cls.storage().load_from_file()
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        cls.storage().save_to_file()
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def flush(cls):
+        """ Wait until pending changes are on disk
+        """
+        cls.storage().flush()
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        self.updated_at = utcnow()
+        self.__class__.storage().save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        self.__class__.storage().remove(self)
+
+    @classmethod
+    def bulk(cls, saves: Iterable[TypeVar('Base')] = (),
+             removes: Iterable[TypeVar('Base')] = ()):
+        """ Save and remove many objects with a single persistence write
+        """
+        now = utcnow()
+        ops = []
+        for obj in saves:
+            obj.updated_at = now
+            ops.append(("save", obj))
+        ops.extend(("remove", obj) for obj in removes)
+        cls.storage().apply(ops)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return cls.storage().count()
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,21 +321,33 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return cls.storage().get(id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return cls.storage().search(attributes)
+
+    @classmethod
+    def suggest(cls, text: str, limit: int = 10) -> List[TypeVar('Base')]:
+        """ At most limit objects with a SEARCH_ATTRIBUTES value starting
+        with text, ignoring case, best first: exact matches, then by
+        attribute, then by value
+        """
+        return cls.storage().suggest(text, limit)
 
+    @classmethod
+    def query(cls, where: dict = {}, order_by: str = None,
+              descending: bool = False, limit: int = None, offset: int = 0,
+              fields: Iterable[str] = None) -> Iterator:
+        """ Objects matching every condition of where, produced lazily
+        where maps attributes to a value (equality) or to a Prefix,
+        Range or In predicate of models.query; with fields, each object
+        is projected to a JSON dictionary of those attributes
+        """
+        objs = cls.storage().query(where, order_by, descending, limit,
+                                   offset)
+        if fields is None:
+            return objs
+        return (obj.project(fields) for obj in objs)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+""" Group commit module
+"""
+import atexit
+import logging
+import threading
+import time
+
+
+class GroupCommit():
+    """ Collects saves/removes and persists them together
+    every interval_ms milliseconds or max_changes changes
+    """
+
+    def __init__(self, interval_ms: int, max_changes: int = 1000):
+        """ Initialize the flusher; the thread starts on the first change
+        """
+        self.interval = interval_ms / 1000
+        self.max_changes = max_changes
+        # storage -> {id: (op, obj)}: only the last change of an object counts
+        self._pending = {}
+        # storage -> {id: (op, obj)} of the batch being written
+        self._inflight = {}
+        self._changes = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.stats = {
+            "changes": 0,
+            "flushes": 0,
+            "objects_written": 0,
+            "flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+        }
+        atexit.register(self.flush)
+
+    def mark(self, storage, op: str, obj):
+        """ Record a change and return at once
+        """
+        with self._cond:
+            self._pending.setdefault(storage, {})[obj.id] = (op, obj)
+            self._changes += 1
+            self.stats["changes"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True,
+                                                name="base-group-commit")
+                self._thread.start()
+            if self._changes >= self.max_changes:
+                self._cond.notify()
+
+    def pending(self, storage) -> set:
+        """ IDs of the objects of storage with changes not yet written,
+        including those of a batch whose write hasn't returned
+        """
+        with self._cond:
+            return set(self._pending.get(storage, {})) | \
+                set(self._inflight.get(storage, {}))
+
+    def _run(self):
+        """ Flusher loop; a failed flush is logged and retried after
+        the interval, its changes kept pending
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._changes >= self.max_changes,
+                    timeout=self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "group commit failed, retrying in %ss", self.interval)
+                time.sleep(self.interval)
+
+    def _restore(self, storage, ops: dict):
+        """ Put back changes whose write failed, unless the object
+        changed again since
+        """
+        with self._cond:
+            pending = self._pending.setdefault(storage, {})
+            for obj_id, change in ops.items():
+                pending.setdefault(obj_id, change)
+            self._changes = sum(len(ops) for ops in self._pending.values())
+
+    def flush(self, storage=None):
+        """ Persist every pending change (or only those of storage)
+        Returns once they are on disk; if a write fails, its changes
+        stay pending and the first error is raised
+        """
+        with self._flush_lock:
+            with self._cond:
+                if storage is None:
+                    batch, self._pending = self._pending, {}
+                    self._changes = 0
+                else:
+                    batch = {storage: self._pending.pop(storage, {})}
+                    self._changes = sum(len(ops) for ops in
+                                        self._pending.values())
+                self._inflight = dict(batch)
+            start = time.perf_counter()
+            written = 0
+            error = None
+            for target, ops in batch.items():
+                if len(ops) == 0:
+                    continue
+                try:
+                    written += target.write_batch(list(ops.values()))
+                except Exception as e:
+                    self._restore(target, ops)
+                    error = error or e
+                finally:
+                    with self._cond:
+                        self._inflight.pop(target, None)
+            elapsed = time.perf_counter() - start
+            if written > 0:
+                self.stats["flushes"] += 1
+                self.stats["objects_written"] += written
+                self.stats["flush_seconds"] += elapsed
+                self.stats["max_flush_seconds"] = max(
+                    self.stats["max_flush_seconds"], elapsed)
+            if error is not None:
+                raise error
+
+    def counters(self) -> dict:
+        """ Stats plus derived write amplification and flush latency
+        """
+        stats = dict(self.stats)
+        stats["pending"] = self._changes
+        stats["write_amplification"] = (
+            stats["objects_written"] / stats["changes"]
+            if stats["changes"] else 0.0)
+        stats["avg_flush_seconds"] = (
+            stats["flush_seconds"] / stats["flushes"]
+            if stats["flushes"] else 0.0)
+        return stats
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+""" Index module
+"""
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class HashIndex():
+    """ Secondary hash index: attribute value -> object IDs
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on attribute
+        """
+        self.attribute = attribute
+        # value -> {id: None}: a dict keeps IDs in insertion order
+        self._ids = {}
+        # id -> value currently indexed, to unlink it on update
+        self._values = {}
+        # IDs whose value can't be hashed: always returned as candidates
+        self._unhashable = {}
+
+    def add(self, obj_id: str, value: Any):
+        """ Index (or re-index) one object
+        """
+        self.discard(obj_id)
+        try:
+            self._ids.setdefault(value, {})[obj_id] = None
+            self._values[obj_id] = value
+        except TypeError:
+            self._unhashable[obj_id] = None
+
+    def discard(self, obj_id: str):
+        """ Forget one object
+        """
+        self._unhashable.pop(obj_id, None)
+        if obj_id not in self._values:
+            return
+        value = self._values.pop(obj_id)
+        bucket = self._ids[value]
+        del bucket[obj_id]
+        if len(bucket) == 0:
+            del self._ids[value]
+
+    def lookup(self, value: Any) -> Iterable[str]:
+        """ IDs of the objects that may hold value
+        """
+        try:
+            ids = self._ids.get(value, {})
+        except TypeError:
+            return list(self._values.keys()) + list(self._unhashable.keys())
+        if len(self._unhashable) == 0:
+            return list(ids.keys())
+        return list(ids.keys()) + list(self._unhashable.keys())
+
+    def clear(self):
+        """ Drop every entry
+        """
+        self._ids = {}
+        self._values = {}
+        self._unhashable = {}
+
+
+def build_indexes(attributes: Iterable[str]) -> Dict[str, HashIndex]:
+    """ One empty HashIndex per attribute
+    """
+    return {attribute: HashIndex(attribute) for attribute in attributes}
+
+
+class SortedIndex():
+    """ Ordered secondary index: (key, ID) pairs sorted in two parallel
+    lists searched with bisect; equal keys are ordered by ID
+    key maps an attribute value to a sortable str, or None when the
+    value can't be held (such objects are only counted)
+    """
+
+    def __init__(self, attribute: str, key: Callable[[Any], str]):
+        """ Initialize an empty index on attribute
+        """
+        self.attribute = attribute
+        self.key = key
+        self._keys = []
+        self._ids = []
+        # id -> key currently indexed, to find it again on update
+        self._key_of = {}
+        # IDs whose value has no key
+        self.unsorted = {}
+        self._deferred = False
+
+    @contextmanager
+    def loading(self):
+        """ Add many objects and sort them once at the end,
+        instead of one insertion each
+        """
+        self._deferred = True
+        try:
+            yield
+        finally:
+            self._deferred = False
+            pairs = sorted((k, obj_id) for obj_id, k in self._key_of.items())
+            self._keys = [pair[0] for pair in pairs]
+            self._ids = [pair[1] for pair in pairs]
+
+    def _position(self, key: str, obj_id: str, right: bool = False) -> int:
+        """ Position of (key, ID) in the lists
+        """
+        lo = bisect_left(self._keys, key)
+        hi = bisect_right(self._keys, key, lo)
+        return (bisect_right if right else bisect_left)(
+            self._ids, obj_id, lo, hi)
+
+    def add(self, obj_id: str, value: Any):
+        """ Index (or re-index) one object
+        """
+        self.discard(obj_id)
+        key = self.key(value)
+        if key is None:
+            self.unsorted[obj_id] = None
+            return
+        self._key_of[obj_id] = key
+        if self._deferred:
+            return
+        if len(self._keys) == 0 or \
+                (key, obj_id) > (self._keys[-1], self._ids[-1]):
+            # Increasing keys (time-ordered IDs, timestamps): an append
+            self._keys.append(key)
+            self._ids.append(obj_id)
+        else:
+            position = self._position(key, obj_id)
+            self._keys.insert(position, key)
+            self._ids.insert(position, obj_id)
+
+    def discard(self, obj_id: str):
+        """ Forget one object
+        """
+        self.unsorted.pop(obj_id, None)
+        key = self._key_of.pop(obj_id, None)
+        if key is None or self._deferred:
+            return
+        position = self._position(key, obj_id)
+        del self._keys[position]
+        del self._ids[position]
+
+    def bounds(self, low: Any = None, high: Any = None,
+               exclusive_low: bool = False,
+               inclusive_high: bool = False) -> Optional[Tuple[int, int]]:
+        """ Positions [start, stop) of the keys between low and high,
+        or None if a bound has no key
+        """
+        start, stop = 0, len(self._keys)
+        if low is not None:
+            low = self.key(low)
+            if low is None:
+                return None
+            start = (bisect_right if exclusive_low else bisect_left)(
+                self._keys, low)
+        if high is not None:
+            high = self.key(high)
+            if high is None:
+                return None
+            stop = (bisect_right if inclusive_high else bisect_left)(
+                self._keys, high)
+        return start, max(start, stop)
+
+    def lookup(self, value: Any) -> Optional[List[str]]:
+        """ IDs of the objects whose value has the same key,
+        or None if it has none
+        """
+        return self.range(value, value, inclusive_high=True)
+
+    def range(self, low: Any = None, high: Any = None,
+              exclusive_low: bool = False,
+              inclusive_high: bool = False) -> Optional[List[str]]:
+        """ IDs of the keys between low and high, in order,
+        or None if a bound has no key or there is none (which would
+        leave out the unsorted objects)
+        """
+        if low is None and high is None:
+            return None
+        bounds = self.bounds(low, high, exclusive_low, inclusive_high)
+        if bounds is None:
+            return None
+        return self._ids[bounds[0]:bounds[1]]
+
+    def chunk(self, bounds: tuple, descending: bool = False,
+              resume: Tuple[str, str] = None,
+              size: int = 1000) -> List[Tuple[str, str]]:
+        """ Next (key, ID) pairs, at most size, of the range given as
+        (low, high, exclusive_low, inclusive_high), after the pair
+        resume: a seek, so a long scan can be read chunk by chunk
+        """
+        positions = self.bounds(*bounds)
+        if positions is None:
+            return []
+        start, stop = positions
+        if descending:
+            if resume is not None:
+                stop = min(stop, self._position(*resume))
+            start = max(start, stop - size)
+            return list(zip(self._keys[start:stop],
+                            self._ids[start:stop]))[::-1]
+        if resume is not None:
+            start = max(start, self._position(*resume, right=True))
+        stop = min(stop, start + size)
+        return list(zip(self._keys[start:stop], self._ids[start:stop]))
+
+    def clear(self):
+        """ Drop every entry
+        """
+        self._keys = []
+        self._ids = []
+        self._key_of = {}
+        self.unsorted = {}
+
+
+def build_sorted_indexes(attributes: Iterable[str],
+                         key: Callable[[Any], str]
+                         ) -> Dict[str, SortedIndex]:
+    """ One empty SortedIndex per attribute
+    """
+    return {attribute: SortedIndex(attribute, key)
+            for attribute in attributes}
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+""" Lazy loading module
+"""
+import json
+from typing import Any, Iterator, TextIO, Tuple
+
+
+class LazyObjects(dict):
+    """ DATA[<Class>] mapping that keeps the raw JSON record of each object
+    (its text, or a dict) and builds the object on first access
+    """
+
+    def __init__(self, cls: type):
+        """ Initialize an empty mapping of cls objects
+        """
+        super().__init__()
+        self._cls = cls
+
+    def _build(self, value: Any) -> Any:
+        """ Object of a raw record (objects are returned as is)
+        """
+        if type(value) is str:
+            value = json.loads(value)
+        if type(value) is dict:
+            value = self._cls(**value)
+        return value
+
+    def _materialize(self, obj_id: str, value: Any) -> Any:
+        """ Swap a raw record for its object
+        """
+        obj = self._build(value)
+        if obj is not value:
+            super().__setitem__(obj_id, obj)
+        return obj
+
+    def __getitem__(self, obj_id: str) -> Any:
+        return self._materialize(obj_id, super().__getitem__(obj_id))
+
+    def get(self, obj_id: str, default: Any = None) -> Any:
+        """ Object by ID, built if needed
+        """
+        if obj_id not in self:
+            return default
+        return self[obj_id]
+
+    def pop(self, obj_id: str, *default) -> Any:
+        """ Remove and return the object
+        """
+        if obj_id not in self and len(default) > 0:
+            return default[0]
+        return self._build(super().pop(obj_id))
+
+    def values(self) -> Iterator[Any]:
+        """ Every object, built as the iteration reaches it
+        """
+        for obj_id in list(self.keys()):
+            yield self[obj_id]
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """ Every (ID, object) pair, built as the iteration reaches it
+        """
+        for obj_id in list(self.keys()):
+            yield obj_id, self[obj_id]
+
+    def raw_items(self) -> Iterator[Tuple[str, Any]]:
+        """ (ID, raw record or object) pairs, without building anything
+        """
+        return iter(dict(self).items())
+
+
+def iter_json_object(f: TextIO, chunk_size: int = 1 << 20
+                     ) -> Iterator[Tuple[str, Any, str]]:
+    """ Yield (key, value, value text) for the top-level JSON object in f,
+    reading it chunk by chunk instead of holding the whole text
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+
+    def peek() -> str:
+        """ Next non-blank character, reading more text if needed
+        """
+        nonlocal buf, pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return ''
+            buf, pos = buf[pos:] + chunk, 0
+
+    def decode() -> Tuple[Any, str]:
+        """ Next JSON value and its text, reading until it is complete
+        A number is the only value that doesn't end itself: one at the
+        end of the text read, or followed by a number character, may be
+        cut (12|345, 1|e-7), so it is decoded again with more text
+        """
+        nonlocal buf, pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                if buf[pos] in '-0123456789' and \
+                        buf[end:end + 1] in ('', *'0123456789.eE+-'):
+                    error = None
+                else:
+                    text, pos = buf[pos:end], end
+                    return value, text
+            except json.JSONDecodeError as e:
+                error = e
+            chunk = f.read(chunk_size)
+            if not chunk:
+                if error is not None:
+                    raise error
+                text, pos = buf[pos:end], end
+                return value, text
+            buf, pos = buf[pos:] + chunk, 0
+
+    def expect(chars: str) -> str:
+        """ Consume one structural character among chars
+        """
+        nonlocal pos
+        char = peek()
+        if char == '' or char not in chars:
+            raise ValueError("Expecting one of {!r} at {!r}".format(
+                chars, buf[pos:pos + 20]))
+        pos += 1
+        return char
+
+    if peek() == '':
+        return
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = decode()[0]
+        expect(':')
+        yield (key,) + decode()
+        if expect(',}') == '}':
+            return
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+""" Query module
+"""
+import heapq
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+
+class Predicate():
+    """ Condition on one attribute value
+    """
+
+    def match(self, value: Any) -> bool:
+        """ True if value satisfies the condition
+        """
+        raise NotImplementedError
+
+    def bounds(self) -> Optional[tuple]:
+        """ (low, high, exclusive_low, inclusive_high) enclosing the
+        matching values, or None if they aren't a range
+        """
+        return None
+
+    def candidates(self, index) -> Optional[Iterable[str]]:
+        """ IDs that may match, read from a HashIndex or SortedIndex,
+        or None if the index can't narrow this condition
+        """
+        bounds = self.bounds()
+        if bounds is None or not hasattr(index, 'range'):
+            return None
+        return index.range(*bounds)
+
+    def mapped(self, function: Callable[[Any], Any]) -> 'Predicate':
+        """ The same condition with its values passed through function
+        """
+        return self
+
+
+class Eq(Predicate):
+    """ value == expected
+    """
+
+    def __init__(self, value: Any):
+        """ Initialize the condition
+        """
+        self.value = value
+
+    def match(self, value: Any) -> bool:
+        """ True if value equals the expected one
+        """
+        return value == self.value
+
+    def bounds(self) -> Optional[tuple]:
+        """ The value alone
+        """
+        if self.value is None:
+            return None
+        return (self.value, self.value, False, True)
+
+    def candidates(self, index) -> Optional[Iterable[str]]:
+        """ IDs indexed under the value
+        """
+        return index.lookup(self.value)
+
+    def mapped(self, function: Callable[[Any], Any]) -> Predicate:
+        """ value == function(expected)
+        """
+        return Eq(function(self.value))
+
+
+class In(Predicate):
+    """ value in expected values
+    """
+
+    def __init__(self, values: Iterable[Any]):
+        """ Initialize the condition
+        """
+        self.values = list(values)
+
+    def match(self, value: Any) -> bool:
+        """ True if value is one of the expected ones
+        """
+        return value in self.values
+
+    def candidates(self, index) -> Optional[Iterable[str]]:
+        """ IDs of the hash buckets of the values
+        """
+        ids = {}
+        for value in self.values:
+            found = index.lookup(value)
+            if found is None:
+                return None
+            ids.update(dict.fromkeys(found))
+        return list(ids)
+
+    def mapped(self, function: Callable[[Any], Any]) -> Predicate:
+        """ value in the expected values passed through function
+        """
+        return In(function(value) for value in self.values)
+
+
+class Prefix(Predicate):
+    """ str value starting with prefix
+    """
+
+    def __init__(self, prefix: str):
+        """ Initialize the condition
+        """
+        self.prefix = prefix
+
+    def match(self, value: Any) -> bool:
+        """ True if value is a string starting with the prefix
+        """
+        return type(value) is str and value.startswith(self.prefix)
+
+    def bounds(self) -> Optional[tuple]:
+        """ prefix <= value < prefix with its last character incremented
+        (same code point order as str)
+        """
+        prefix = self.prefix
+        if type(prefix) is not str or len(prefix) == 0 or \
+                ord(prefix[-1]) == 0x10FFFF:
+            return None
+        return (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1), False, False)
+
+    def mapped(self, function: Callable[[Any], Any]) -> Predicate:
+        """ value starting with function(prefix)
+        """
+        return Prefix(function(self.prefix))
+
+
+class Range(Predicate):
+    """ low <= value < high (either bound optional)
+    """
+
+    def __init__(self, low: Any = None, high: Any = None,
+                 inclusive: bool = False, exclusive_low: bool = False):
+        """ Initialize the condition; inclusive makes high included,
+        exclusive_low makes low excluded (as a pagination cursor)
+        """
+        self.low = low
+        self.high = high
+        self.inclusive = inclusive
+        self.exclusive_low = exclusive_low
+
+    def match(self, value: Any) -> bool:
+        """ True if value lies in the range
+        """
+        try:
+            if value is None:
+                return False
+            if self.low is not None:
+                if value < self.low or (self.exclusive_low and
+                                        value == self.low):
+                    return False
+            if self.high is not None:
+                if self.inclusive:
+                    return value <= self.high
+                return value < self.high
+            return True
+        except TypeError:
+            return False
+
+    def bounds(self) -> Optional[tuple]:
+        """ The range itself
+        """
+        return (self.low, self.high, self.exclusive_low, self.inclusive)
+
+    def mapped(self, function: Callable[[Any], Any]) -> Predicate:
+        """ The range between both bounds passed through function
+        """
+        return Range(function(self.low), function(self.high),
+                     self.inclusive, self.exclusive_low)
+
+
+class Keyed(Predicate):
+    """ predicate tested on key(value), key being the one a sorted index
+    orders the attribute by: its own values are mapped through key too,
+    so a bound the index accepts matches as the index reads it (values
+    key can't map are compared as they are)
+    """
+
+    def __init__(self, predicate: Predicate, key: Callable[[Any], Any]):
+        """ Initialize the condition
+        """
+        self.key = key
+        self.predicate = predicate.mapped(self.convert)
+
+    def convert(self, value: Any) -> Any:
+        """ key(value), or value if key can't map it
+        """
+        converted = self.key(value)
+        return value if converted is None else converted
+
+    def match(self, value: Any) -> bool:
+        """ True if the key of value satisfies the condition
+        """
+        return self.predicate.match(self.convert(value))
+
+
+def as_predicate(value: Any) -> Predicate:
+    """ Predicate as is; any other value means equality
+    """
+    if isinstance(value, Predicate):
+        return value
+    return Eq(value)
+
+
+def matches_all(obj, predicates: dict) -> bool:
+    """ True if every attribute of obj satisfies its predicate
+    """
+    for attribute, predicate in predicates.items():
+        if not predicate.match(getattr(obj, attribute, None)):
+            return False
+    return True
+
+
+def sort_key(attribute: str):
+    """ Key ordering objects by attribute, None last and
+    values of different types apart instead of failing
+    """
+    def key(obj):
+        value = getattr(obj, attribute, None)
+        if value is None:
+            return (1, '', 0)
+        return (0, type(value).__name__, value)
+    return key
+
+
+def paginate(objs: Iterator, order_by: str = None, descending: bool = False,
+             limit: int = None, offset: int = 0) -> Iterator:
+    """ Sort, skip and cut an iterator of objects, lazily when unsorted;
+    a sort with a limit only keeps offset + limit objects in memory
+    """
+    if order_by is not None:
+        key = sort_key(order_by)
+        if limit is not None:
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            objs = iter(pick(offset + limit, objs, key=key))
+        else:
+            objs = iter(sorted(objs, key=key, reverse=descending))
+    stop = None if limit is None else offset + limit
+    return islice(objs, offset, stop)
@@ -0,0 +1,1023 @@
+#!/usr/bin/env python3
+""" Storage backends module
+"""
+from contextlib import ExitStack, contextmanager
+from os import getenv, path
+from typing import Any, Callable, Iterable, Iterator, List, Optional, \
+    Tuple, TypeVar
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from models.group_commit import GroupCommit
+from models.index import build_indexes, build_sorted_indexes
+from models.lazy import LazyObjects, iter_json_object
+from models.query import Eq, In, Keyed, Prefix, as_predicate, \
+    matches_all, paginate
+from models.rwlock import RWLock
+
+
+DATA = {}
+INDEXES = {}
+SORTED_INDEXES = {}
+SEARCH_INDEXES = {}
+# "json": every write rewrites .db_<Class>.json
+# "journal": every write appends one line to .db_<Class>.journal
+# "sqlite": one table per class in BASE_SQLITE_PATH, indexed columns
+STORAGE = getenv("BASE_STORAGE", "json")
+JOURNAL_MAX_BYTES = int(getenv("BASE_JOURNAL_MAX_BYTES", 4 * 1024 * 1024))
+SQLITE_PATH = getenv("BASE_SQLITE_PATH", ".db.sqlite3")
+# With BASE_GROUP_COMMIT_MS set, JSON saves/removes return at once and
+# a background flusher persists them every N ms or M changes
+GROUP_COMMIT = None
+if int(getenv("BASE_GROUP_COMMIT_MS", 0)) > 0:
+    GROUP_COMMIT = GroupCommit(int(getenv("BASE_GROUP_COMMIT_MS")),
+                               int(getenv("BASE_GROUP_COMMIT_CHANGES", 1000)))
+# With BASE_LAZY_LOAD set, load_from_file keeps raw records and objects
+# are only built when first accessed
+LAZY_LOAD = getenv("BASE_LAZY_LOAD", "") not in ("", "0")
+# With BASE_MULTIPROCESS set, JSON writes hold an advisory lock on
+# .db_<Class>.lock and reads first pick up changes of other processes
+MULTIPROCESS = getenv("BASE_MULTIPROCESS", "") not in ("", "0")
+STORAGES = {}
+
+
+def file_signature(file_path: str) -> Tuple[int, int, int]:
+    """ (inode, mtime in ns, size) of a file, or None if it is missing
+    A rename-replaced file gets a new inode, an appended one a new size
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class Storage():
+    """ Storage backend of one model class
+    """
+
+    def __init__(self, cls: type):
+        """ Initialize the backend of cls
+        """
+        self.cls = cls
+        self.name = cls.__name__
+
+    def load_from_file(self):
+        """ (Re)load the persisted objects
+        """
+        raise NotImplementedError
+
+    def save_to_file(self):
+        """ Persist every object
+        """
+        raise NotImplementedError
+
+    def get(self, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        raise NotImplementedError
+
+    def candidates(self, predicates: dict) -> Iterator[TypeVar('Base')]:
+        """ Objects that may satisfy the predicates (a superset)
+        """
+        raise NotImplementedError
+
+    def query(self, where: dict, order_by: str = None,
+              descending: bool = False, limit: int = None,
+              offset: int = 0) -> Iterator[TypeVar('Base')]:
+        """ Objects satisfying every condition of where, lazily
+        """
+        predicates = {k: as_predicate(v) for k, v in where.items()}
+        tests = self.tests(predicates)
+        objs = (obj for obj in self.candidates(predicates)
+                if matches_all(obj, tests))
+        return paginate(objs, order_by, descending, limit, offset)
+
+    def tests(self, predicates: dict) -> dict:
+        """ predicates as objects are tested against them: those on
+        SORTED_ATTRIBUTES compare sortable keys, as the sorted indexes
+        do, so a timestamp string bound matches timestamps
+        """
+        return {attribute: Keyed(predicate, self.cls.sortable)
+                if attribute in self.cls.SORTED_ATTRIBUTES else predicate
+                for attribute, predicate in predicates.items()}
+
+    def search(self, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return all objects with matching attributes
+        """
+        return list(self.query(attributes))
+
+    def suggest(self, text: str, limit: int = 10) -> List[TypeVar('Base')]:
+        """ At most limit objects with a SEARCH_ATTRIBUTES value starting
+        with text, ignoring case; ranked exact matches first, then by
+        attribute (in SEARCH_ATTRIBUTES order), then by value
+        Each attribute contributes its first limit matches only: any
+        further one ranks below limit distinct objects already
+        """
+        prefix = self.cls.searchable(text)
+        if not prefix or limit <= 0:
+            return []
+        found = []
+        for rank, attribute in enumerate(self.cls.SEARCH_ATTRIBUTES):
+            for key, obj_id in self.prefixed(attribute, prefix, limit):
+                found.append((key != prefix, rank, key, obj_id))
+        ids = {}
+        for match in sorted(found):
+            ids.setdefault(match[3])
+            if len(ids) == limit:
+                break
+        objs = (self.get(obj_id) for obj_id in ids)
+        return [obj for obj in objs if obj is not None]
+
+    def prefixed(self, attribute: str, prefix: str,
+                 limit: int) -> List[Tuple[str, str]]:
+        """ (key, ID) of the first limit objects, in key order, whose
+        searchable attribute starts with prefix
+        """
+        raise NotImplementedError
+
+    def count(self) -> int:
+        """ Count all objects
+        """
+        raise NotImplementedError
+
+    def all(self) -> List[TypeVar('Base')]:
+        """ Return all objects
+        """
+        return self.search({})
+
+    def save(self, obj: TypeVar('Base')):
+        """ Store (insert or update) one object
+        """
+        raise NotImplementedError
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one object
+        """
+        raise NotImplementedError
+
+    def apply(self, ops: List[tuple]):
+        """ Apply several (op, obj) saves/removes, persisted together
+        """
+        raise NotImplementedError
+
+    def write_batch(self, ops: List[tuple]) -> int:
+        """ Persist (op, obj) changes; return the number of objects written
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Wait until every accepted change is durable
+        """
+
+
+class JsonStorage(Storage):
+    """ Objects in DATA, persisted to .db_<Class>.json
+    (rewritten on every write, or followed by an append-only journal)
+    """
+
+    # IDs read from a sorted index per lock hold during a scan
+    SCAN_CHUNK = 256
+    # A batch changing over 1/BULK_SORT_RATIO of the objects re-sorts
+    # the ordered indexes once instead of inserting into them one by one
+    BULK_SORT_RATIO = 100
+
+    def __init__(self, cls: type, journal: bool = False):
+        """ Initialize the backend of cls
+        """
+        super().__init__(cls)
+        self.journal = journal
+        self.file_path = ".db_{}.json".format(self.name)
+        self.journal_path = ".db_{}.journal".format(self.name)
+        self.lock_path = ".db_{}.lock".format(self.name)
+        # Multi-process mode: signatures of the files as last seen,
+        # journal bytes already applied and a digest of each record
+        self._generation = None
+        self._journal_offset = 0
+        self._digests = {}
+        # Threads read DATA together and change it one at a time;
+        # IDs changed in memory whose write is still under way
+        self.rwlock = RWLock()
+        self._unwritten = {}
+        # Serializes file writes between the threads of this process
+        self._file_lock = threading.Lock()
+        if DATA.get(self.name) is None:
+            DATA[self.name] = {}
+
+    @property
+    def objects(self) -> dict:
+        """ The objects of the class, by ID
+        """
+        return DATA[self.name]
+
+    def indexes(self) -> dict:
+        """ Secondary indexes of the class, by attribute
+        """
+        indexes = INDEXES.get(self.name)
+        if indexes is None:
+            # Filled before it is published: readers never see it partial
+            indexes = build_indexes(self.cls.INDEXED_ATTRIBUTES)
+            for obj in self.objects.values():
+                for attribute, index in indexes.items():
+                    index.add(obj.id, getattr(obj, attribute, None))
+            INDEXES[self.name] = indexes
+        return indexes
+
+    def _built(self, registry: dict, attributes: Iterable[str],
+               key: Callable[[Any], str]) -> dict:
+        """ SortedIndexes of the class in registry, built if needed
+        """
+        indexes = registry.get(self.name)
+        if indexes is None:
+            indexes = build_sorted_indexes(attributes, key)
+            for index in indexes.values():
+                with index.loading():
+                    for obj in self.objects.values():
+                        index.add(obj.id, obj.stored(index.attribute))
+            registry[self.name] = indexes
+        return indexes
+
+    def sorted_indexes(self) -> dict:
+        """ Ordered indexes of the class (SORTED_ATTRIBUTES), by attribute
+        """
+        return self._built(SORTED_INDEXES, self.cls.SORTED_ATTRIBUTES,
+                           self.cls.sortable)
+
+    def search_indexes(self) -> dict:
+        """ Case-insensitive prefix indexes of the class
+        (SEARCH_ATTRIBUTES), by attribute
+        """
+        return self._built(SEARCH_INDEXES, self.cls.SEARCH_ATTRIBUTES,
+                           self.cls.searchable)
+
+    def all_indexes(self) -> list:
+        """ Every index of the class
+        """
+        return list(self.indexes().values()) + \
+            list(self.sorted_indexes().values()) + \
+            list(self.search_indexes().values())
+
+    def index(self, obj: TypeVar('Base')):
+        """ Update every index with the current values of the object
+        """
+        for index in self.all_indexes():
+            index.add(obj.id, obj.stored(index.attribute))
+
+    def unindex(self, obj_id: str):
+        """ Remove an object from every index
+        """
+        for index in self.all_indexes():
+            index.discard(obj_id)
+
+    @contextmanager
+    def locked(self, shared: bool = False):
+        """ Hold the lock of the class files: exclusive between the
+        threads of this process, and an advisory lock between processes
+        in multi-process mode
+        """
+        if shared and not MULTIPROCESS:
+            yield
+            return
+        with ExitStack() as stack:
+            if not shared:
+                stack.enter_context(self._file_lock)
+            if MULTIPROCESS:
+                f = stack.enter_context(open(self.lock_path, 'a'))
+                # Closing the file releases the lock
+                fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def generation(self) -> tuple:
+        """ Signatures of the snapshot and the journal of the class
+        """
+        return (file_signature(self.file_path),
+                file_signature(self.journal_path))
+
+    def _seen(self):
+        """ Remember the files as they are now (lock held)
+        """
+        self._generation = self.generation()
+        journal = self._generation[1]
+        self._journal_offset = 0 if journal is None else journal[2]
+
+    def refresh(self, exclude: Iterable[str] = ()):
+        """ Pick up the changes other processes wrote since the files
+        were last seen; costs two stat calls when there are none
+        """
+        if not MULTIPROCESS or self.generation() == self._generation:
+            return
+        with self.locked(shared=True):
+            self._refresh(exclude)
+
+    def _refresh(self, exclude: Iterable[str] = ()):
+        """ Reload the records that changed on disk (lock held)
+        Objects in exclude, or still pending in the group commit,
+        have changes of their own not written yet and are kept
+        """
+        generation = self.generation()
+        if generation == self._generation:
+            return
+        with self.rwlock.write():
+            exclude = set(exclude)
+            exclude.update(self._unwritten)
+            if GROUP_COMMIT is not None:
+                exclude.update(GROUP_COMMIT.pending(self))
+            snapshot, journal = generation
+            last = self._generation or (None, None)
+            if (last[0] is not None and snapshot == last[0] and
+                    journal is not None and
+                    self._journal_offset <= journal[2] and
+                    (last[1] is None or last[1][0] == journal[0])):
+                # Same snapshot, journal appended: read the new lines only
+                changes = self.read_journal(self._journal_offset)
+                for obj_id, obj_json in changes.items():
+                    self._merge(obj_id, obj_json, None, exclude)
+            else:
+                # Snapshot rewritten: keep the records whose text is the same
+                found = set()
+                for obj_id, obj_json, text in self.iter_records():
+                    found.add(obj_id)
+                    self._merge(obj_id, obj_json, text, exclude)
+                for obj_id in list(self.objects.keys()):
+                    if obj_id not in found and obj_id not in exclude:
+                        self._drop(obj_id)
+            self._seen()
+
+    def _merge(self, obj_id: str, obj_json: dict, text: str,
+               exclude: set):
+        """ Apply one record read back from disk, if it changed
+        """
+        if obj_id in exclude:
+            return
+        if obj_json is None:
+            self._drop(obj_id)
+            return
+        if text is None:
+            text = json.dumps(obj_json)
+        if (obj_id not in self.objects or
+                self._digests.get(obj_id) != hash(text)):
+            self._put(obj_id, obj_json, text)
+
+    def _put(self, obj_id: str, obj_json: dict, text: str = None):
+        """ Register one persisted record in DATA and the indexes
+        """
+        if MULTIPROCESS:
+            if text is None:
+                text = json.dumps(obj_json)
+            self._digests[obj_id] = hash(text)
+        if LAZY_LOAD:
+            # The record text is far smaller than its decoded dict
+            self.objects[obj_id] = obj_json if text is None else text
+            for index in self.all_indexes():
+                index.add(obj_id, obj_json.get(index.attribute))
+        else:
+            obj = self.cls(**obj_json)
+            self.objects[obj_id] = obj
+            self.index(obj)
+
+    def _drop(self, obj_id: str):
+        """ Forget one object removed on disk
+        """
+        self.objects.pop(obj_id, None)
+        self._digests.pop(obj_id, None)
+        self.unindex(obj_id)
+
+    def iter_records(self) -> Iterator[Tuple[str, dict, str]]:
+        """ (ID, JSON record, record text or None) of every persisted
+        object: the snapshot read record by record, then the journal
+        """
+        changes = self.read_journal()
+        if path.exists(self.file_path):
+            with open(self.file_path, 'r') as f:
+                # Record by record: the file text is never held whole
+                for obj_id, obj_json, text in iter_json_object(f):
+                    if obj_id in changes:
+                        obj_json, text = changes.pop(obj_id), None
+                        if obj_json is None:
+                            continue
+                    yield obj_id, obj_json, text
+        for obj_id, obj_json in changes.items():
+            if obj_json is not None:
+                yield obj_id, obj_json, None
+
+    def load_from_file(self):
+        """ Load all objects from file
+        The journal, if any, is replayed over the snapshot
+        """
+        self.flush()
+        with self.locked():
+            with self.rwlock.write(), ExitStack() as stack:
+                DATA[self.name] = LazyObjects(self.cls) if LAZY_LOAD else {}
+                INDEXES[self.name] = build_indexes(
+                    self.cls.INDEXED_ATTRIBUTES)
+                SORTED_INDEXES[self.name] = build_sorted_indexes(
+                    self.cls.SORTED_ATTRIBUTES, self.cls.sortable)
+                SEARCH_INDEXES[self.name] = build_sorted_indexes(
+                    self.cls.SEARCH_ATTRIBUTES, self.cls.searchable)
+                for index in list(SORTED_INDEXES[self.name].values()) + \
+                        list(SEARCH_INDEXES[self.name].values()):
+                    # Sorted once at the end, not insertion by insertion
+                    stack.enter_context(index.loading())
+                self._digests = {}
+                for obj_id, obj_json, text in self.iter_records():
+                    self._put(obj_id, obj_json, text)
+
+            if self.journal_size() > 0 and not self.journal:
+                # Full-file mode would leave the journal stale: fold it in
+                self.compact()
+            self._seen()
+
+    def save_to_file(self):
+        """ Save all objects to file
+        """
+        # Copy first: the group commit flusher runs beside writers
+        with self.rwlock.read():
+            objs = self.objects
+            items = objs.raw_items() if isinstance(objs, LazyObjects) \
+                else dict(objs).items()
+
+        # Write aside then rename, so a crash never leaves half a file.
+        # Records are written one by one, in json.dump's layout; those
+        # never accessed since a lazy load are written as read
+        tmp_path = "{}.tmp".format(self.file_path)
+        with open(tmp_path, 'w') as f:
+            separator = ''
+            f.write('{')
+            for obj_id, obj in items:
+                if type(obj) is not str:
+                    obj = json.dumps(obj if type(obj) is dict
+                                     else obj.to_json(True))
+                if MULTIPROCESS:
+                    self._digests[obj_id] = hash(obj)
+                f.write('{}{}: {}'.format(separator, json.dumps(obj_id), obj))
+                separator = ', '
+            f.write('}')
+        os.replace(tmp_path, self.file_path)
+
+    def append_journal(self, ops: List[tuple]):
+        """ Append save/remove records in one write,
+        compacting past the threshold
+        """
+        lines = []
+        for op, obj in ops:
+            record = {"op": op, "id": obj.id}
+            if op == "save":
+                record["obj"] = obj.to_json(True)
+                if MULTIPROCESS:
+                    self._digests[obj.id] = hash(json.dumps(record["obj"]))
+            lines.append(json.dumps(record) + "\n")
+        with open(self.journal_path, 'a') as f:
+            f.write("".join(lines))
+            size = f.tell()
+        if size > JOURNAL_MAX_BYTES:
+            self.compact()
+
+    def journal_size(self) -> int:
+        """ Size in bytes of the journal of the class
+        """
+        if not path.exists(self.journal_path):
+            return 0
+        return os.path.getsize(self.journal_path)
+
+    def read_journal(self, offset: int = 0) -> dict:
+        """ Last journaled state of each object (from byte offset on):
+        its JSON record, or None if it was removed
+        """
+        changes = {}
+        if not path.exists(self.journal_path):
+            return changes
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line of an interrupted append
+                    break
+                changes[record["id"]] = record.get("obj")
+        return changes
+
+    def compact(self):
+        """ Write a new snapshot and empty the journal
+        Replaying a journal over a newer snapshot is harmless,
+        so a crash between both steps loses nothing
+        """
+        self.save_to_file()
+        if path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def current(self, ops: List[tuple]) -> List[tuple]:
+        """ (op, obj) of each changed object as DATA holds it now
+        Writes can reach the files in another order than the changes
+        reached DATA, so the object's presence decides the record, not
+        the op: a save of an object since removed writes its removal
+        """
+        with self.rwlock.read():
+            current = []
+            for op, obj in ops:
+                now = self.objects.get(obj.id)
+                current.append(("remove", obj) if now is None
+                               else ("save", now))
+            return current
+
+    def write_batch(self, ops: List[tuple]) -> int:
+        """ Persist (op, obj) changes with the configured storage
+        Return the number of objects written
+        """
+        with self.locked():
+            if MULTIPROCESS:
+                # Merge the other processes' writes first, not clobber them
+                self._refresh(obj.id for op, obj in ops)
+            if self.journal:
+                # Under the file lock: the last record of an object is
+                # written after its last change
+                self.append_journal(self.current(ops))
+                written = len(ops)
+            else:
+                self.save_to_file()
+                written = len(self.objects)
+            if MULTIPROCESS:
+                self._seen()
+        return written
+
+    def persist(self, ops: List[tuple]):
+        """ Make saves/removes durable, now (in one write) or at the next
+        group commit
+        """
+        if GROUP_COMMIT is not None:
+            for op, obj in ops:
+                GROUP_COMMIT.mark(self, op, obj)
+        elif len(ops) > 0:
+            self.write_batch(ops)
+
+    def flush(self):
+        """ Wait until pending group-commit changes are on disk
+        """
+        if GROUP_COMMIT is not None:
+            GROUP_COMMIT.flush(self)
+
+    def apply(self, ops: List[tuple]):
+        """ Apply (op, obj) saves/removes to DATA, then persist them
+        with a single write; removes of absent objects are skipped
+        """
+        done = []
+        with self.rwlock.write(), ExitStack() as stack:
+            if len(ops) * self.BULK_SORT_RATIO > len(self.objects):
+                for index in list(self.sorted_indexes().values()) + \
+                        list(self.search_indexes().values()):
+                    stack.enter_context(index.loading())
+            for op, obj in ops:
+                if op == "save":
+                    self.objects[obj.id] = obj
+                    self.index(obj)
+                elif self.objects.get(obj.id) is not None:
+                    del self.objects[obj.id]
+                    self.unindex(obj.id)
+                else:
+                    continue
+                self._unwritten[obj.id] = self._unwritten.get(obj.id, 0) + 1
+                done.append((op, obj))
+        try:
+            self.persist(done)
+        finally:
+            with self.rwlock.write():
+                for op, obj in done:
+                    self._unwritten[obj.id] -= 1
+                    if self._unwritten[obj.id] == 0:
+                        del self._unwritten[obj.id]
+
+    def save(self, obj: TypeVar('Base')):
+        """ Store one object
+        """
+        self.apply([("save", obj)])
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one object
+        """
+        self.apply([("remove", obj)])
+
+    def count(self) -> int:
+        """ Count all objects
+        """
+        self.refresh()
+        with self.rwlock.read():
+            return len(self.objects.keys())
+
+    def get(self, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        self.refresh()
+        with self.rwlock.read():
+            return self.objects.get(obj_id)
+
+    def query(self, where: dict, order_by: str = None,
+              descending: bool = False, limit: int = None,
+              offset: int = 0) -> Iterator[TypeVar('Base')]:
+        """ Objects satisfying every condition of where, lazily
+        A sort on an attribute with a sorted index reads the index in
+        order instead: a page costs a seek, not a sort of every match,
+        unless another condition narrows to fewer objects
+        """
+        index = None
+        if order_by is not None:
+            index = self.sorted_indexes().get(order_by)
+        predicates = {k: as_predicate(v) for k, v in where.items()}
+        bounds = None
+        if order_by in predicates:
+            bounds = predicates[order_by].bounds()
+        bounds = bounds or (None, None, False, False)
+        if index is not None and len(index.unsorted) > 0 and \
+                bounds[:2] == (None, None):
+            # Objects without a key must still come, last
+            index = None
+        if index is None:
+            return super().query(where, order_by, descending, limit, offset)
+        self.refresh()
+        with self.rwlock.read():
+            positions = index.bounds(*bounds)
+            # The range of the sort index itself is measured, not copied
+            ids = self.narrowest({k: v for k, v in predicates.items()
+                                  if k != order_by})
+        if positions is None or \
+                (ids is not None and len(ids) < positions[1] - positions[0]):
+            return super().query(where, order_by, descending, limit, offset)
+        tests = self.tests(predicates)
+        objs = (obj for obj in self.scan(index, bounds, descending)
+                if matches_all(obj, tests))
+        return paginate(objs, None, False, limit, offset)
+
+    def scan(self, index, bounds: tuple,
+             descending: bool = False) -> Iterator[TypeVar('Base')]:
+        """ Objects in the order of a SortedIndex, within bounds,
+        reading SCAN_CHUNK IDs at a time under the lock
+        """
+        objs = self.objects
+        resume = None
+        while True:
+            with self.rwlock.read():
+                chunk = index.chunk(bounds, descending, resume,
+                                    self.SCAN_CHUNK)
+            for key, obj_id in chunk:
+                try:
+                    yield objs[obj_id]
+                except KeyError:
+                    # Removed since the chunk was read
+                    continue
+            if len(chunk) < self.SCAN_CHUNK:
+                return
+            resume = chunk[-1]
+
+    def narrowest(self, predicates: dict) -> Optional[List[str]]:
+        """ IDs of the smallest set the hash and sorted indexes narrow
+        the predicates to, or None if no index helps (hold the lock)
+        """
+        indexes = (self.indexes(), self.sorted_indexes())
+        ids = None
+        for attribute, predicate in predicates.items():
+            for index in (kind.get(attribute) for kind in indexes):
+                if index is None:
+                    continue
+                found = predicate.candidates(index)
+                if found is not None and (ids is None or
+                                          len(found) < len(ids)):
+                    ids = found
+        return ids
+
+    def candidates(self, predicates: dict) -> Iterator[TypeVar('Base')]:
+        """ Objects of the smallest index bucket set the predicates
+        narrow to, or all of them
+        IDs are snapshotted under the lock; objects are fetched as the
+        iteration reaches them (single-key reads need no lock)
+        """
+        self.refresh()
+        with self.rwlock.read():
+            objs = self.objects
+            ids = self.narrowest(predicates)
+            if ids is None:
+                ids = list(objs.keys())
+
+        for obj_id in ids:
+            try:
+                yield objs[obj_id]
+            except KeyError:
+                # Removed since the snapshot
+                continue
+
+    def prefixed(self, attribute: str, prefix: str,
+                 limit: int) -> List[Tuple[str, str]]:
+        """ (key, ID) of the first limit objects, in key order, whose
+        searchable attribute starts with prefix: a seek in its index
+        """
+        self.refresh()
+        bounds = Prefix(prefix).bounds() or (prefix, None, False, False)
+        with self.rwlock.read():
+            chunk = self.search_indexes()[attribute].chunk(
+                bounds, size=limit)
+        return [pair for pair in chunk if pair[0].startswith(prefix)]
+
+
+class SqliteStorage(Storage):
+    """ One SQLite table per class: the JSON record of each object plus
+    an indexed column per INDEXED_ATTRIBUTES and SORTED_ATTRIBUTES (the
+    latter holding sortable keys). Objects are read on demand and every
+    write touches only its own row
+    """
+
+    # Values SQLite can compare in a WHERE clause
+    SQL_TYPES = (str, int, float, type(None))
+    # Rows read per statement by candidates()
+    SCAN_CHUNK = 256
+
+    def __init__(self, cls: type, db_path: str = SQLITE_PATH):
+        """ Initialize the backend of cls, creating its table if needed
+        """
+        super().__init__(cls)
+        self.db_path = db_path
+        # Sorted attributes are stored as keys, compared as strings
+        self.keyed = tuple(a for a in cls.SORTED_ATTRIBUTES
+                           if a != "id" and a not in cls.INDEXED_ATTRIBUTES)
+        self.columns = tuple(cls.INDEXED_ATTRIBUTES) + self.keyed
+        self._local = threading.local()
+        columns = "".join(', "{}"'.format(c) for c in self.columns)
+        self.connection().execute(
+            'CREATE TABLE IF NOT EXISTS "{}" '
+            '(id TEXT PRIMARY KEY, data TEXT NOT NULL{})'.format(
+                self.name, columns))
+        missing = self.missing_columns()
+        for column in self.columns:
+            self.connection().execute(
+                'CREATE INDEX IF NOT EXISTS "ix_{0}_{1}" '
+                'ON "{0}" ("{1}")'.format(self.name, column))
+        for attribute in cls.SEARCH_ATTRIBUTES:
+            self.connection().execute(
+                'CREATE INDEX IF NOT EXISTS "ix_{0}_search_{1}" '
+                'ON "{0}" ({2})'.format(self.name, attribute,
+                                        self.search_key(attribute)))
+        assignments = "".join(', "{0}" = excluded."{0}"'.format(c)
+                              for c in self.columns)
+        self._upsert = (
+            'INSERT INTO "{}" (id, data{}) VALUES (?, ?{}) '
+            'ON CONFLICT (id) DO UPDATE SET data = excluded.data{}'.format(
+                self.name, columns, ", ?" * len(self.columns), assignments))
+        if len(missing) > 0:
+            self.fill_columns(missing)
+
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread (autocommit, WAL)
+        """
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = conn
+        return conn
+
+    def missing_columns(self) -> List[str]:
+        """ Add the columns a table created by an earlier version lacks;
+        return their names
+        """
+        conn = self.connection()
+        present = {row[1] for row in conn.execute(
+            'PRAGMA table_info("{}")'.format(self.name))}
+        missing = [c for c in self.columns if c not in present]
+        for column in missing:
+            conn.execute('ALTER TABLE "{}" ADD COLUMN "{}"'.format(
+                self.name, column))
+        return missing
+
+    def fill_columns(self, columns: List[str]):
+        """ Compute columns of every row from its JSON record
+        """
+        conn = self.connection()
+        sql = 'UPDATE "{}" SET {} WHERE id = ?'.format(
+            self.name, ", ".join('"{}" = ?'.format(c) for c in columns))
+        conn.execute("BEGIN")
+        try:
+            rows = conn.execute(
+                'SELECT id, data FROM "{}"'.format(self.name)).fetchall()
+            conn.executemany(sql, (
+                tuple(self.value(c, record.get(c)) for c in columns) +
+                (obj_id,) for obj_id, record in
+                ((row[0], json.loads(row[1])) for row in rows)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def value(self, column: str, value: object) -> object:
+        """ Value of a column: the sortable key of a sorted attribute,
+        else the value if SQLite can compare it, else its JSON
+        """
+        if column in self.keyed:
+            return self.cls.sortable(value)
+        return value if type(value) in self.SQL_TYPES else json.dumps(value)
+
+    def _row(self, obj: TypeVar('Base')) -> tuple:
+        """ Parameters of the upsert statement for obj
+        """
+        return (obj.id, json.dumps(obj.to_json(True))) + tuple(
+            self.value(column, obj.stored(column))
+            for column in self.columns)
+
+    def load_from_file(self):
+        """ Nothing is loaded up front; an empty table is seeded once
+        from the JSON snapshot and journal of the class, if any
+        """
+        if self.count() > 0:
+            return
+        records = JsonStorage(self.cls).iter_records()
+        rows = ((obj_id, json.dumps(obj_json) if text is None else text) +
+                tuple(self.value(column, obj_json.get(column))
+                      for column in self.columns)
+                for obj_id, obj_json, text in records)
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(self._upsert, rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def save_to_file(self):
+        """ Every write is already in the database
+        """
+
+    def get(self, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        row = self.connection().execute(
+            'SELECT data FROM "{}" WHERE id = ?'.format(self.name),
+            (obj_id,)).fetchone()
+        return None if row is None else self.cls(**json.loads(row[0]))
+
+    def condition(self, column: str, predicate) -> Tuple[str, list]:
+        """ SQL condition and parameters narrowing to the rows that may
+        satisfy predicate, or (None, None) if it can't be expressed
+        """
+        if column in self.keyed:
+            convert = self.cls.sortable
+        else:
+            def convert(value):
+                return value if type(value) in self.SQL_TYPES else None
+        if type(predicate) is Eq:
+            if predicate.value is None:
+                return '"{}" IS NULL'.format(column), []
+            param = convert(predicate.value)
+            if param is None:
+                return None, None
+            return '"{}" = ?'.format(column), [param]
+        if type(predicate) is In:
+            params = [convert(v) for v in predicate.values]
+            if None in params:
+                return None, None
+            return '"{}" IN ({})'.format(
+                column, ", ".join("?" * len(params))), params
+        bounds = predicate.bounds()
+        if bounds is None:
+            return None, None
+        low, high, exclusive_low, inclusive_high = bounds
+        clauses = []
+        params = []
+        for bound, op in ((low, ">" if exclusive_low else ">="),
+                          (high, "<=" if inclusive_high else "<")):
+            if bound is None:
+                continue
+            param = convert(bound)
+            if param is None:
+                return None, None
+            clauses.append('"{}" {} ?'.format(column, op))
+            params.append(param)
+        if len(clauses) == 0:
+            return None, None
+        return " AND ".join(clauses), params
+
+    def query(self, where: dict, order_by: str = None,
+              descending: bool = False, limit: int = None,
+              offset: int = 0) -> Iterator[TypeVar('Base')]:
+        """ Objects satisfying every condition of where, lazily
+        A sort on id is left to the primary key, so reading stops after
+        offset + limit matches
+        """
+        if order_by != "id":
+            return super().query(where, order_by, descending, limit, offset)
+        predicates = {k: as_predicate(v) for k, v in where.items()}
+        tests = self.tests(predicates)
+        objs = (obj for obj in self.candidates(predicates, "id", descending)
+                if matches_all(obj, tests))
+        return paginate(objs, None, False, limit, offset)
+
+    def candidates(self, predicates: dict, order: str = "rowid",
+                   descending: bool = False) -> Iterator[TypeVar('Base')]:
+        """ Rows narrowed in SQL by the predicates on id and indexed
+        columns, in order of the rowid or id column
+        Rows are read SCAN_CHUNK at a time, each chunk seeking past the
+        last one: no statement stays open between chunks, so a partly
+        read result doesn't keep a read snapshot that fails later
+        writes of the thread with "database is locked"
+        """
+        where = []
+        params = []
+        for attribute, predicate in predicates.items():
+            if attribute not in self.columns and attribute != "id":
+                continue
+            clause, values = self.condition(attribute, predicate)
+            if clause is not None:
+                where.append(clause)
+                params.extend(values)
+        sql = 'SELECT {}, data FROM "{}" WHERE '.format(order, self.name)
+        seek = "{} {} ?".format(order, "<" if descending else ">")
+        sql_order = " ORDER BY {}{} LIMIT {}".format(
+            order, " DESC" if descending else "", self.SCAN_CHUNK)
+        last = None
+        while True:
+            clauses = where if last is None else where + [seek]
+            rows = self.connection().execute(
+                sql + (" AND ".join(clauses) or "1") + sql_order,
+                params if last is None else params + [last]).fetchall()
+            for row in rows:
+                yield self.cls(**json.loads(row[1]))
+            if len(rows) < self.SCAN_CHUNK:
+                return
+            last = rows[-1][0]
+
+    @staticmethod
+    def search_key(attribute: str) -> str:
+        """ SQL expression of the search key of an attribute, read from
+        the JSON record (SQLite lowers ASCII letters only)
+        """
+        return "lower(json_extract(data, '$.{}'))".format(attribute)
+
+    def prefixed(self, attribute: str, prefix: str,
+                 limit: int) -> List[Tuple[str, str]]:
+        """ (key, ID) of the first limit objects, in key order, whose
+        searchable attribute starts with prefix: a seek in the
+        expression index of the attribute
+        """
+        key = self.search_key(attribute)
+        bounds = Prefix(prefix).bounds()
+        sql = 'SELECT {0}, id FROM "{1}" WHERE {0} >= ?'.format(key,
+                                                                self.name)
+        params = [prefix]
+        if bounds is not None:
+            sql += " AND {} < ?".format(key)
+            params.append(bounds[1])
+        rows = self.connection().execute(
+            sql + " ORDER BY {} LIMIT ?".format(key),
+            params + [limit]).fetchall()
+        return [tuple(row) for row in rows if row[0].startswith(prefix)]
+
+    def count(self) -> int:
+        """ Count all objects
+        """
+        return self.connection().execute(
+            'SELECT COUNT(*) FROM "{}"'.format(self.name)).fetchone()[0]
+
+    def write_batch(self, ops: List[tuple]) -> int:
+        """ Apply (op, obj) changes in one transaction
+        """
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            for op, obj in ops:
+                if op == "save":
+                    conn.execute(self._upsert, self._row(obj))
+                else:
+                    conn.execute('DELETE FROM "{}" WHERE id = ?'.format(
+                        self.name), (obj.id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(ops)
+
+    def apply(self, ops: List[tuple]):
+        """ Apply (op, obj) saves/removes in one transaction
+        """
+        self.write_batch(ops)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update one row
+        """
+        self.connection().execute(self._upsert, self._row(obj))
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one row
+        """
+        self.connection().execute(
+            'DELETE FROM "{}" WHERE id = ?'.format(self.name), (obj.id,))
+
+
+def storage_for(cls: type) -> Storage:
+    """ Backend of cls, created on first use from BASE_STORAGE
+    """
+    storage = STORAGES.get(cls)
+    if storage is None:
+        if STORAGE == "sqlite":
+            storage = SqliteStorage(cls)
+        else:
+            storage = JsonStorage(cls, journal=(STORAGE == "journal"))
+        STORAGES[cls] = storage
+    return storage